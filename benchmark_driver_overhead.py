@@ -0,0 +1,154 @@
+#!python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Runs each example's driver against the mock Cubit/Flex backend: mock_coreform.py next to this script, which every
+# example's coreform_utils imports when COREFORM_BACKEND=mock. The measured time is therefore the Python orchestration
+# cost alone: command generation, model setup, result parsing and bookkeeping. Every run happens in a fresh process and a fresh scratch directory. Command and job counts come from the
+# driver's main process only; commands issued by worker processes (-nj, --pipeline) are not counted.
+
+parser = argparse.ArgumentParser( prog='BenchmarkDriverOverhead' )
+
+def cli_arguments( parser ):
+    parser.add_argument( "benchmarks", type=str, nargs="*", help=f"Benchmarks to run (default: all of {list( benchmarks.keys() )})" )
+    parser.add_argument( "--repeat", dest="repeat", type=int, default=3, help="Fresh-process runs per benchmark" )
+    parser.add_argument( "--inner-repeat", dest="inner_repeat", type=int, default=20, help="Calls per run of the in-process make_cad/build_flex benchmarks" )
+    parser.add_argument( "--latency", dest="latency", type=float, default=0.0, help="Seconds the mock spends in every cmd() call" )
+    parser.add_argument( "--job-latency", dest="job_latency", type=float, default=0.0, help="Seconds the mock spends in every job wait" )
+    parser.add_argument( "--output", dest="output", type=str, default=None, help="Write the results as JSON, for tracking across commits" )
+    return parser.parse_args()
+
+repo_dir = os.path.dirname( os.path.realpath( __file__ ) )
+
+diw_setup = """
+import os, time, json, sys
+import diw_simulation, make_cad, build_flex
+from coreform_utils import EvaluationContext
+params = diw_simulation.test_cases["iter_0"]
+timings = { "make_cad": [], "build_flex": [] }
+for i in range( 0, INNER_REPEAT ):
+    eval_ctx = EvaluationContext( os.path.join( os.getcwd(), f"diw_{i}" ), i )
+    eval_ctx.make_work_dir()
+    start_time = time.perf_counter()
+    make_cad.cubit_commands( { "cad_file": "diw_cad.cf", "test_name": "diw", "params": params }, eval_ctx )
+    timings["make_cad"].append( time.perf_counter() - start_time )
+    start_time = time.perf_counter()
+    build_flex.flex_commands( { "cad_file": "diw_cad.cf", "cf_cad_file": "geom.cf", "test_name": "diw", "flex_journal": True, "params": params }, eval_ctx )
+    timings["build_flex"].append( time.perf_counter() - start_time )
+sys.__stdout__.write( "TIMINGS " + json.dumps( timings ) + "\\n" )
+"""
+
+pipe_make_cad_setup = """
+import os, time, json, sys
+import make_cad, coreform_utils
+params = make_cad.initial_params
+timings = { "make_cad": [] }
+for i in range( 0, INNER_REPEAT ):
+    eval_ctx = coreform_utils.EvaluationContext( os.path.join( os.getcwd(), f"simulation_{i}" ), i, make_cad.eval_files )
+    eval_ctx.make_work_dir()
+    start_time = time.perf_counter()
+    make_cad.create_geom( params, eval_ctx )
+    timings["make_cad"].append( time.perf_counter() - start_time )
+sys.__stdout__.write( "TIMINGS " + json.dumps( timings ) + "\\n" )
+"""
+
+benchmarks = {
+                "plate_with_hole_sweep":        { "directory": "plate_with_hole_sweep",        "script": "plate_with_hole_sweep.py" },
+                "plate_with_hole_pipeline":     { "directory": "plate_with_hole_sweep",        "script": "plate_with_hole_sweep.py", "args": [ "--pipeline" ] },
+                "plate_with_hole_optimization": { "directory": "plate_with_hole_optimization", "script": "plate_with_hole_optimization.py" },
+                "plate_with_hole_surrogate":    { "directory": "plate_with_hole_optimization", "script": "plate_with_hole_optimization.py", "args": [ "--surrogate", "--max-solves", "6" ] },
+                "pipe_optimization":            { "directory": "pipe_optimization",            "script": "pipe_optimization.py" },
+                "pipe_make_cad":                { "directory": "pipe_optimization",            "code": pipe_make_cad_setup },
+                "diw_make_cad_build_flex":      { "directory": "diw_pad",                      "code": diw_setup },
+             }
+
+def main( args ):
+    names = args.benchmarks if len( args.benchmarks ) > 0 else list( benchmarks.keys() )
+    for name in names:
+        if name not in benchmarks:
+            parser.error( f"unknown benchmark {name}; choose from {list( benchmarks.keys() )}" )
+    results = {}
+    for name in names:
+        results[name] = run_benchmark( benchmarks[name], args )
+        print_result( name, results[name] )
+    if args.output is not None:
+        with open( args.output, "w" ) as f:
+            json.dump( { "settings": { "repeat": args.repeat, "inner_repeat": args.inner_repeat, "latency": args.latency, "job_latency": args.job_latency },
+                         "results": results }, f, indent=2 )
+
+def run_benchmark( benchmark, args ):
+    directory = os.path.join( repo_dir, benchmark["directory"] )
+    runs = []
+    for repetition in range( 0, args.repeat ):
+        with tempfile.TemporaryDirectory( prefix="driver_overhead_" ) as work_dir:
+            stats_filename = os.path.join( work_dir, "mock_stats.json" )
+            env = dict( os.environ, COREFORM_BACKEND="mock", COREFORM_MOCK_STATS=stats_filename,
+                        COREFORM_MOCK_LATENCY=str( args.latency ), COREFORM_MOCK_JOB_LATENCY=str( args.job_latency ),
+                        PYTHONPATH=os.pathsep.join( [ directory, os.environ.get( "PYTHONPATH", "" ) ] ) )
+            if "code" in benchmark:
+                command = [ sys.executable, "-c", benchmark["code"].replace( "INNER_REPEAT", str( args.inner_repeat ) ) ]
+            else:
+                command = [ sys.executable, os.path.join( directory, benchmark["script"] ) ] + benchmark.get( "args", [] )
+            start_time = time.perf_counter()
+            process = subprocess.run( command, cwd=work_dir, env=env, capture_output=True, text=True )
+            wall_time = time.perf_counter() - start_time
+            if process.returncode != 0:
+                return { "error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}" }
+            run = { "wall_time": wall_time, "stages": parse_timings( process.stdout ) }
+            if os.path.exists( stats_filename ):
+                with open( stats_filename ) as f:
+                    run["mock"] = json.load( f )
+            runs.append( run )
+    return summarize( runs )
+
+def parse_timings( stdout ):
+    for line in stdout.splitlines():
+        if line.startswith( "TIMINGS " ):
+            return json.loads( line[len( "TIMINGS " ):] )
+    return {}
+
+def summarize( runs ):
+    wall_times = [ run["wall_time"] for run in runs ]
+    result = { "wall_time_min": min( wall_times ), "wall_time_median": statistics.median( wall_times ) }
+    mock_stats = runs[-1].get( "mock", {} )
+    # Time from the mock's import to process exit: excludes interpreter startup and the imports that come before coreform_utils
+    elapsed = [ run["mock"]["elapsed"] for run in runs if "mock" in run ]
+    if len( elapsed ) > 0:
+        result["in_process_median"] = statistics.median( elapsed )
+    for product in ( "cubit", "flex" ):
+        if product in mock_stats:
+            result[f"{product}_commands"] = mock_stats[product]["num_commands"]
+    if "flex" in mock_stats:
+        result["flex_jobs"] = mock_stats["flex"]["num_jobs"]
+    for stage in runs[-1]["stages"]:
+        times = [ value for run in runs for value in run["stages"][stage] ]
+        result[f"{stage}_median"] = statistics.median( times )
+        result[f"{stage}_min"] = min( times )
+    return result
+
+def print_result( name, result ):
+    if "error" in result:
+        print( f"{name}: FAILED ({result['error']})" )
+        return
+    line = f"{name}: wall {result['wall_time_median']:.3f} s (min {result['wall_time_min']:.3f} s)"
+    if "in_process_median" in result:
+        line += f", in-process {result['in_process_median']:.3f} s"
+    if "flex_jobs" in result and result["flex_jobs"] > 0:
+        line += f", {result['flex_jobs']} job(s), {result['in_process_median'] / result['flex_jobs'] * 1e3:.2f} ms per job"
+    if "cubit_commands" in result or "flex_commands" in result:
+        line += f", {result.get( 'cubit_commands', 0 )} Cubit / {result.get( 'flex_commands', 0 )} Flex command(s)"
+    print( line )
+    for key in result:
+        if key.endswith( "_median" ) and key not in ( "wall_time_median", "in_process_median" ):
+            stage = key[:-len( "_median" )]
+            print( f"  {stage}: median {result[key] * 1e3:.3f} ms, min {result[stage + '_min'] * 1e3:.3f} ms per call" )
+
+if __name__ == '__main__':
+    main( cli_arguments( parser ) )
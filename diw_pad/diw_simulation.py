@@ -1,15 +1,21 @@
 #!python3
 
 import os
-import sys
-import numpy as np
+import time
 import json
+import argparse
+import itertools
+import multiprocessing
+import concurrent.futures
+import numpy as np
 
 from make_cad import cubit_commands
 from build_flex import flex_commands
-from coreform_utils import mk_script_relative
+from coreform_utils import mk_script_relative, get_session, EvaluationContext
 import sim_data_fitting
 import read_geometry_dimensions
+import probe_results
+import result_store
 
 script_relative = mk_script_relative( __file__ )
 
@@ -19,48 +25,80 @@ test_cases = {
                 "iter_2":   { "thread_radius": 0.055, "thread_spacing": 0.45, "layer_overlap_ratio": 0.1, "num_threads": 0, "num_layers": 2, "poissons_ratio": 0.48, "degree": 2, "solver": "quasistatic", "stabilization": True,  "platen_mesh_bodyfit": True, "num_proc": 4 },
              }
 
-test_case_ids = list( test_cases.keys() )
-for test_id in test_case_ids:
-    degree = test_cases[test_id]["degree"]
-    thread_radius = test_cases[test_id]["thread_radius"]
+def set_mesh_size( params ):
+    degree = params["degree"]
+    thread_radius = params["thread_radius"]
     mesh_size = min( [ 2 * thread_radius / ( degree + 1 ), thread_radius / (degree + 1) ] ) # there is a factor 1 / (degree+1) to avoid cross-talk across gaps
-    test_cases[test_id]["mesh_size"] = mesh_size
+    params["mesh_size"] = mesh_size
 
-def run( test_id ):
+test_case_ids = list( test_cases.keys() )
+for test_id in test_case_ids:
+    set_mesh_size( test_cases[test_id] )
+
+def make_grid( base_params, thread_radii=None, thread_spacings=None, poissons_ratios=None ):
+    # Full factorial grid over the given values; an axis that is not given keeps the base case's value
+    thread_radii = thread_radii or [ base_params["thread_radius"] ]
+    thread_spacings = thread_spacings or [ base_params["thread_spacing"] ]
+    poissons_ratios = poissons_ratios or [ base_params["poissons_ratio"] ]
+    grid = {}
+    for thread_radius, thread_spacing, poissons_ratio in itertools.product( thread_radii, thread_spacings, poissons_ratios ):
+        params = dict( base_params )
+        params["thread_radius"] = thread_radius
+        params["thread_spacing"] = thread_spacing
+        params["poissons_ratio"] = poissons_ratio
+        set_mesh_size( params )
+        grid[f"r{thread_radius:g}_s{thread_spacing:g}_nu{poissons_ratio:g}"] = params
+    return grid
+
+store_design = ( "thread_radius", "thread_spacing", "layer_overlap_ratio", "num_threads", "num_layers", "poissons_ratio" )
+
+def run( test_id, params=None, store=None ):
+    if params is None:
+        params = test_cases[test_id]
+    start_time = time.perf_counter()
     cad_file = 'diw_cad.cf'
     cf_cad_file = 'geom.cf'
     top_wd = os.getcwd()
 
     test_name = f"diw_{test_id}"
-    subdir = os.path.join( top_wd, test_name )
-    if not os.path.exists( subdir ):
-        os.makedirs( subdir )
-    os.chdir( subdir )
+    eval_ctx = EvaluationContext( os.path.join( top_wd, test_name ), test_id )
+    subdir = eval_ctx.make_work_dir()
 
     cad_cmds_args = { 'cad_file': cad_file,
                       'test_name': test_name,
-                      'params': test_cases[test_id] }
+                      'params': params }
 
     flex_cmds_args = {  'cad_file': cad_file,
                         'cf_cad_file': cf_cad_file,
                         'test_name': test_name,
-                        'params': test_cases[test_id] }
-
-    cubit_commands( cad_cmds_args )
-    flex_commands( flex_cmds_args )
-    os.chdir( top_wd )
-    process_results( subdir, test_id )
+                        'flex_journal': True,
+                        'params': params }
+
+    cubit_commands( cad_cmds_args, eval_ctx )
+    flex_commands( flex_cmds_args, eval_ctx )
+    results = process_results( subdir, test_id, params )
+    if store is not None:
+        # The probe file was parsed by process_results, so this is served from memory
+        eng_stress, eng_strain = get_eng_stress_strain_data( subdir )
+        design = { name: params[name] for name in store_design }
+        histories = { "eng_strain": eng_strain, "eng_stress": eng_stress }
+        store.record( "diw_pad", design, params, results, histories, time.perf_counter() - start_time )
+    return results
 
 def get_eng_stress_strain_data( subdir ):
     pad_height, pad_volume_ratio, platen_width, top_platen_y_probe = read_geometry_dimensions.main( subdir )
     probe_filename = os.path.join( subdir, "jobs", "cf_iga_data_output.json" )
-    probe_file = open( probe_filename, "r" )
-    output_data = json.load( probe_file )['compress_pad']
-    probe_data = output_data['history']
-    probe_file.close()
+    reaction_force_path = "compress_pad/history/bot_reaction_probe/reaction_force/y"
+    displacement_path = "compress_pad/history/top_platen_probe/displacement/y"
+    probe_data = probe_results.read_probes( probe_filename, [ reaction_force_path, displacement_path ] )
 
-    reaction_force = np.array( probe_data['bot_reaction_probe']['reaction_force']['y'] )
-    displacement = -1.0 *np.array( probe_data['top_platen_probe']['displacement']['y'] )[:,0]
+    reaction_force = probe_data[reaction_force_path]
+    displacement = -1.0 * probe_data[displacement_path][:,0]
+
+    # Scale a unit-cell model back to the full pad: the force and loaded area both grow with the number of cells
+    num_cells = read_geometry_dimensions.cell_multiplicity( subdir )
+    reaction_force = num_cells * reaction_force
+    platen_width = np.sqrt( num_cells ) * platen_width
 
     platen_width /= 1000
     eng_stress = ( reaction_force / ( platen_width**2.0 ) ) / 1000
@@ -68,7 +106,9 @@ def get_eng_stress_strain_data( subdir ):
     return eng_stress, eng_strain
     
 
-def process_results( subdir, test_id ):
+def process_results( subdir, test_id, params=None ):
+    if params is None:
+        params = test_cases[test_id]
     pad_volume_ratio = read_geometry_dimensions.main( subdir )[1]
     eng_stress, eng_strain = get_eng_stress_strain_data( subdir )
 
@@ -84,7 +124,7 @@ def process_results( subdir, test_id ):
     # that reflects the simulation model shared with KCNSC for demonstration.
     # These values were achieved with the Default workflow with stabilization turned on.
     max_compression_ratio = ( 1 - pad_volume_ratio )
-    use_stabilization = test_cases[test_id]["stabilization"]
+    use_stabilization = params["stabilization"]
     if use_stabilization:
         expected_compression_ratio = 0.85 * max_compression_ratio
         expected_densification_strain = 0.45985049481381585
@@ -104,6 +144,100 @@ def process_results( subdir, test_id ):
     print( f"computed_densification_stress: {computed_densification_stress}" )
     print( f"expected_compression_modulus: {expected_compression_modulus}" )
     print( f"computed_compression_modulus: {computed_compression_modulus}" )
+    return { "compression_ratio": float( computed_compression_ratio ),
+             "densification_strain": float( computed_densification_strain ),
+             "densification_stress": float( computed_densification_stress ),
+             "compression_modulus": float( computed_compression_modulus ) }
+
+def run_case( test_id, params, plot=True, store_dir=None ):
+    # Entry point of a batch worker process; plots and results have to be flushed here since workers skip atexit handlers
+    sim_data_fitting.renderer.enabled = plot
+    store = result_store.ResultStore( store_dir ) if store_dir is not None else None
+    start_time = time.perf_counter()
+    results = run( test_id, params, store )
+    sim_data_fitting.renderer.wait()
+    if store is not None:
+        store.close()
+    results["wall_time"] = time.perf_counter() - start_time
+    return results, get_session().timings_snapshot()
+
+def run_batch( cases, num_cores, plot=True, store_dir=None ):
+    """Runs cases concurrently, each in its own process, while the num_proc of the running cases fits in num_cores.
+    Cases are packed first-fit from the largest num_proc down; a case that needs more than num_cores runs alone."""
+    pending = sorted( cases.keys(), key=lambda test_id: -cases[test_id]["num_proc"] )
+    min_num_proc = min( max( cases[test_id]["num_proc"], 1 ) for test_id in pending )
+    num_workers = max( 1, min( num_cores // min_num_proc, len( pending ) ) )
+    running = {}
+    free_cores = num_cores
+    batch_results = {}
+    # Spawn rather than fork so every worker initializes its own Cubit and Flex instances
+    mp_context = multiprocessing.get_context( "spawn" )
+    with concurrent.futures.ProcessPoolExecutor( max_workers=num_workers, mp_context=mp_context ) as pool:
+        while len( pending ) > 0 or len( running ) > 0:
+            for test_id in list( pending ):
+                num_proc = min( cases[test_id]["num_proc"], num_cores )
+                if len( running ) < num_workers and ( num_proc <= free_cores or len( running ) == 0 ):
+                    if cases[test_id]["num_proc"] > num_cores:
+                        print( f"WARNING: {test_id} requests {cases[test_id]['num_proc']} processes but the budget is {num_cores} cores" )
+                    # Up to num_workers solves share the machine's memory, which bounds the direct solver's budget
+                    future = pool.submit( run_case, test_id, dict( cases[test_id], concurrent_solves=num_workers ), plot, store_dir )
+                    running[future] = ( test_id, num_proc )
+                    free_cores -= num_proc
+                    pending.remove( test_id )
+            done, _ = concurrent.futures.wait( running, return_when=concurrent.futures.FIRST_COMPLETED )
+            for future in done:
+                test_id, num_proc = running.pop( future )
+                free_cores += num_proc
+                try:
+                    results, snapshot = future.result()
+                    get_session().add_worker_timings( snapshot )
+                    batch_results[test_id] = { "params": cases[test_id], **results }
+                    print( f"Finished {test_id} in {batch_results[test_id]['wall_time']:.1f} s ({len( pending ) + len( running )} case(s) left)" )
+                except Exception as e:
+                    batch_results[test_id] = { "params": cases[test_id], "error": repr( e ) }
+                    print( f"FAILED {test_id}: {e!r}" )
+    return batch_results
+
+parser = argparse.ArgumentParser( prog='DIWPadSimulation' )
+batch_summary_file = "diw_batch_summary.json"
+
+def cli_arguments( parser ):
+    parser.add_argument( "test_ids", type=str, nargs="*", help=f"Test cases to run, from {test_case_ids}" )
+    parser.add_argument( "--all", dest="all", action="store_true", help="Run every test case" )
+    parser.add_argument( "--grid-base", dest="grid_base", type=str, choices=test_case_ids, default=test_case_ids[0], help="Test case the grid varies from" )
+    parser.add_argument( "--grid-thread-radius", dest="grid_thread_radius", type=float, nargs="+" )
+    parser.add_argument( "--grid-thread-spacing", dest="grid_thread_spacing", type=float, nargs="+" )
+    parser.add_argument( "--grid-poissons-ratio", dest="grid_poissons_ratio", type=float, nargs="+" )
+    parser.add_argument( "--cores", dest="cores", type=int, default=os.cpu_count() or 1, help="Total cores shared by concurrently running cases" )
+    parser.add_argument( "--no-plots", dest="no_plots", action="store_true", help="Skip rendering the stress-strain plots" )
+    parser.add_argument( "--result-store", dest="result_store", type=os.path.abspath, default="result_store", help="Directory of the evaluation history shared across runs" )
+    return parser.parse_args()
+
+def select_cases( args ):
+    test_ids = test_case_ids if args.all else args.test_ids
+    for test_id in test_ids:
+        if test_id not in test_cases:
+            parser.error( f"unknown test case {test_id}; choose from {test_case_ids}" )
+    cases = { test_id: test_cases[test_id] for test_id in test_ids }
+    if args.grid_thread_radius or args.grid_thread_spacing or args.grid_poissons_ratio:
+        cases.update( make_grid( test_cases[args.grid_base], args.grid_thread_radius, args.grid_thread_spacing, args.grid_poissons_ratio ) )
+    if len( cases ) == 0:
+        parser.error( "no test cases given" )
+    return cases
 
 if __name__ == "__main__":
-    run( sys.argv[-1] )
\ No newline at end of file
+    args = cli_arguments( parser )
+    cases = select_cases( args )
+    if len( cases ) == 1:
+        test_id, params = next( iter( cases.items() ) )
+        sim_data_fitting.renderer.enabled = not args.no_plots
+        store = result_store.ResultStore( args.result_store )
+        run( test_id, params, store )
+        store.close()
+        sim_data_fitting.renderer.shutdown()
+        get_session().print_timings()
+    else:
+        batch_results = run_batch( cases, args.cores, plot=not args.no_plots, store_dir=args.result_store )
+        with open( batch_summary_file, "w" ) as f:
+            json.dump( batch_results, f, indent=2 )
+        get_session().print_timings()
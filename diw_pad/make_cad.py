@@ -1,14 +1,18 @@
 import numpy
 import coreform_utils
 
+ctx = coreform_utils.get_session()
 platen_thickness = 0.1
 
-def cubit_commands( options ):
-    cubit = coreform_utils.import_cubit()
-    cubit.cmd( "reset" )
+def cubit_commands( options, eval_ctx ):
+    cubit = ctx.reset_cubit()
     test_name = options['test_name']
     cad_file = options['cad_file']
     params = options['params']
+    cell_multiplicity = get_cell_multiplicity( params )
+    if cell_multiplicity > 1:
+        # Model only the symmetric unit cell, which is the single-cell stack below
+        params = dict( params, num_threads=0 )
     pad_vol_id = make_pad( cubit, params )
     bot_vol_id, top_vol_id = make_platens( cubit, pad_vol_id )
     cubit.cmd( f"block 1 volume {pad_vol_id}" )
@@ -37,16 +41,24 @@ def cubit_commands( options ):
     cubit.cmd( "sideset 4 name 'zfaces_platen'" )
     cubit.cmd( "sideset 5 name 'bot_platen_ymin'" )
     cubit.cmd( "sideset 6 name 'top_platen_ymax'" )
-    cubit.cmd( "save cub5 'diw_pad.cub5' overwrite" )
+    cubit.cmd( f"save cub5 '{eval_ctx.path( 'diw_pad.cub5' )}' overwrite" )
     if params["platen_mesh_bodyfit"] == True:
         mesh_platens( cubit, top_vol_id, bot_vol_id )
-    cubit.cmd( f"export acis '{test_name}.sat' overwrite" )
-    cubit.cmd( f"export step '{test_name}.stp' overwrite" )
-    cubit.cmd( f"save cub5 '{test_name}.cub5' overwrite" )
-    cubit.cmd( f"export coreform '{cad_file}' overwrite" )
-    export_geometry_dimensions( cubit, pad_vol_id, top_vol_id, bot_vol_id )
+    cubit.cmd( f"export acis '{eval_ctx.path( test_name + '.sat' )}' overwrite" )
+    cubit.cmd( f"export step '{eval_ctx.path( test_name + '.stp' )}' overwrite" )
+    cubit.cmd( f"save cub5 '{eval_ctx.path( test_name + '.cub5' )}' overwrite" )
+    cubit.cmd( f"export coreform '{eval_ctx.path( cad_file )}' overwrite" )
+    export_geometry_dimensions( cubit, pad_vol_id, top_vol_id, bot_vol_id, eval_ctx, cell_multiplicity )
 
-def export_geometry_dimensions( cubit, pad_vol_id, top_vol_id, bot_vol_id ):
+def get_cell_multiplicity( params ):
+    # The thread lattice is mirror symmetric about every plane x = k * thread_spacing / 2 and z = k * thread_spacing / 2,
+    # and the pad and platens already carry symmetry BCs on their x and z faces. The full pad is therefore exactly
+    # ( 2 * num_threads )**2 mirrored copies of the quarter single-cell stack, with the full number of layers.
+    if not params.get( "unit_cell", False ) or params["num_threads"] == 0:
+        return 1
+    return ( 2 * params["num_threads"] )**2
+
+def export_geometry_dimensions( cubit, pad_vol_id, top_vol_id, bot_vol_id, eval_ctx, cell_multiplicity=1 ):
     pad_bbox = cubit.get_total_bounding_box( "volume", [ pad_vol_id, ] )
     top_bbox = cubit.get_total_bounding_box( "volume", [ top_vol_id, ] )
     bot_bbox = cubit.get_total_bounding_box( "volume", [ bot_vol_id, ] )
@@ -55,9 +67,9 @@ def export_geometry_dimensions( cubit, pad_vol_id, top_vol_id, bot_vol_id ):
     pad_height = pad_bbox[4] - pad_bbox[3]
     platen_width = top_bbox[1] - top_bbox[0]
     top_platen_y_probe = top_bbox[3]
-    with open( "pad_dimensions.txt", "w+" ) as f:
-        f.write( "pad_height,pad_volume_ratio,platen_width,top_platen_y_probe\n" )
-        f.write( f"{pad_height},{pad_volume_ratio},{platen_width},{top_platen_y_probe}")
+    with open( eval_ctx.path( "pad_dimensions.txt" ), "w+" ) as f:
+        f.write( "pad_height,pad_volume_ratio,platen_width,top_platen_y_probe,cell_multiplicity\n" )
+        f.write( f"{pad_height},{pad_volume_ratio},{platen_width},{top_platen_y_probe},{cell_multiplicity}")
 
 def create_layer_a( cubit, params ):
     thread_vol_ids = []
@@ -96,6 +108,8 @@ def create_layer_b( cubit, params ):
     return thread_vol_ids
 
 def make_pad( cubit, params ):
+    if params.get( "cad_mode", "per_thread" ) == "batched":
+        return make_pad_batched( cubit, params )
     y_offset = 0.0
     if params["num_threads"] == 0:
         # Special case for single-cell stack
@@ -132,6 +146,81 @@ def make_pad( cubit, params ):
     pad_vol_id = cubit.get_last_id( "volume" )
     return pad_vol_id
 
+def make_pad_batched( cubit, params ):
+    # Sublayers repeat with period 4 in y: [ layer_b, rotated layer_a, layer_a, rotated layer_b ].
+    # Each of these patterns is built, sectioned and united once, then copied up the stack,
+    # and the copies are united pairwise so no single boolean sees every thread at once.
+    if params["num_threads"] == 0:
+        # Special case for single-cell stack
+        num_threads = 1
+    else:
+        num_threads = params["num_threads"]
+    thread_spacing = params["thread_spacing"]
+    thread_length = num_threads * thread_spacing
+    y_step = ( 2 * params['thread_radius'] ) - ( params['layer_overlap_ratio'] * 2 * params['thread_radius'] )
+    num_sublayers = 2 * params["num_layers"]
+    patterns = [ ( create_layer_b_batched, False ), ( create_layer_a_batched, True ), ( create_layer_a_batched, False ), ( create_layer_b_batched, True ) ]
+    initial_vol_ids = set( cubit.get_entities( "volume" ) )
+    for k in range( 0, min( len( patterns ), num_sublayers ) ):
+        create_layer, rotate = patterns[k]
+        vid = create_layer( cubit, params )
+        cubit.cmd( f"move volume {vid} y {k * y_step}" )
+        if rotate:
+            cubit.cmd( f"rotate Volume {vid} angle 90  about Y include_merged" )
+        cubit.cmd( f"section volume {vid} with xplane offset {thread_length/2.0} reverse" )
+        cubit.cmd( f"section volume {vid} with xplane offset -{thread_length/2.0}" )
+        cubit.cmd( f"section volume {vid} with zplane offset {thread_length/2.0} reverse" )
+        cubit.cmd( f"section volume {vid} with zplane offset -{thread_length/2.0}" )
+        num_copies = len( range( k, num_sublayers, len( patterns ) ) ) - 1
+        if num_copies > 0:
+            cubit.cmd( f"volume {vid} copy move y {len( patterns ) * y_step} repeat {num_copies}" )
+    unite_hierarchically( cubit, initial_vol_ids )
+    cubit.cmd( "compress" )
+    pad_vol_id = cubit.get_last_id( "volume" )
+    return pad_vol_id
+
+def create_layer_a_batched( cubit, params ):
+    return create_thread_array( cubit, params, 0 )
+
+def create_layer_b_batched( cubit, params ):
+    return create_thread_array( cubit, params, 1 )
+
+def create_thread_array( cubit, params, extra_threads ):
+    # Same thread positions as create_layer_a (extra_threads=0) or create_layer_b (extra_threads=1),
+    # built from one cylinder and a repeated copy, then united into a single layer volume
+    radius = params['thread_radius']
+    if params["num_threads"] == 0:
+        # Special case for single-cell stack
+        num_threads = 1
+    else:
+        num_threads = params["num_threads"]
+    thread_spacing = params["thread_spacing"]
+    thread_length = num_threads * thread_spacing
+    x_start = -thread_length/2 + ( 1 - extra_threads ) * thread_spacing/2
+    cubit.cmd( f"cylinder radius {radius} height {thread_length}" )
+    first_vol_id = cubit.get_last_id( "volume" )
+    cubit.cmd( f"move volume {first_vol_id} x {x_start}" )
+    num_copies = num_threads + extra_threads - 1
+    if num_copies > 0:
+        cubit.cmd( f"volume {first_vol_id} copy move x {thread_spacing} repeat {num_copies}" )
+        last_vol_id = cubit.get_last_id( "volume" )
+        cubit.cmd( f"unite volume {first_vol_id} to {last_vol_id}" )
+    return pad_volume_ids( cubit, set( range( 0, first_vol_id ) ) )[0]
+
+def unite_hierarchically( cubit, initial_vol_ids ):
+    # Still num_sublayers - 1 unites in all; pairing them only bounds the passes to ceil(log2(num_sublayers)) and keeps
+    # each boolean to two neighboring volumes
+    vol_ids = pad_volume_ids( cubit, initial_vol_ids )
+    while len( vol_ids ) > 1:
+        for i in range( 0, len( vol_ids ) - 1, 2 ):
+            cubit.cmd( f"unite volume {vol_ids[i]} {vol_ids[i+1]}" )
+        vol_ids = pad_volume_ids( cubit, initial_vol_ids )
+
+def pad_volume_ids( cubit, initial_vol_ids ):
+    # Volumes created since initial_vol_ids, ordered bottom to top so that neighbors in the list touch
+    vol_ids = [ vid for vid in cubit.get_entities( "volume" ) if vid not in initial_vol_ids ]
+    return sorted( vol_ids, key=lambda vid: cubit.volume( vid ).bounding_box()[1] )
+
 def make_platens( cubit, pad_vol_id ):
     bbox = cubit.volume( pad_vol_id ).bounding_box()
     platen_x = bbox[3] - bbox[0]
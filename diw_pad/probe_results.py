@@ -0,0 +1,86 @@
+import os
+import json
+import collections
+import numpy
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Files larger than this are streamed with ijson (when installed) instead of being loaded whole
+streaming_threshold = 32 * 1024**2
+# Parsed files kept in memory, least recently read evicted first; a driver rereads only the case it is processing
+max_parsed_files = 4
+parsed_files = collections.OrderedDict()
+
+def read_probes( probe_filename, paths ):
+    """Returns { path: numpy array } for each "/"-separated path into a Flex probe output file.
+    A file is parsed at most once per (mtime, size) while it stays among the max_parsed_files most recently read;
+    later requests for the same paths are served from memory."""
+    probe_filename = os.path.realpath( probe_filename )
+    file_stat = os.stat( probe_filename )
+    file_key = ( file_stat.st_mtime_ns, file_stat.st_size )
+    parsed_file = parsed_files.get( probe_filename )
+    if parsed_file is None or parsed_file["file_key"] != file_key:
+        parsed_file = { "file_key": file_key, "values": {} }
+        parsed_files[probe_filename] = parsed_file
+    parsed_files.move_to_end( probe_filename )
+    while len( parsed_files ) > max_parsed_files:
+        parsed_files.popitem( last=False )
+    missing_paths = [ path for path in paths if path not in parsed_file["values"] ]
+    if len( missing_paths ) > 0:
+        if ijson is not None and file_stat.st_size > streaming_threshold:
+            values = stream_paths( probe_filename, missing_paths )
+        else:
+            values = load_paths( probe_filename, missing_paths )
+        for path, value in values.items():
+            parsed_file["values"][path] = numpy.asarray( value, dtype=float )
+    return { path: parsed_file["values"][path] for path in paths }
+
+def load_paths( probe_filename, paths ):
+    with open( probe_filename ) as probe_file:
+        probe_data = json.load( probe_file )
+    values = {}
+    for path in paths:
+        value = probe_data
+        for key in path.split( "/" ):
+            if key not in value:
+                raise KeyError( f"Probe path '{path}' not found in {probe_filename}" )
+            value = value[key]
+        values[path] = value
+    return values
+
+def stream_paths( probe_filename, paths ):
+    targets = { ".".join( path.split( "/" ) ): path for path in paths }
+    values = {}
+    active = {}
+    with open( probe_filename, "rb" ) as probe_file:
+        for prefix, event, value in ijson.parse( probe_file, use_float=True ):
+            for path in list( active.keys() ):
+                builder, depth = active[path]
+                builder.event( event, value )
+                if event in ( "start_map", "start_array" ):
+                    depth += 1
+                elif event in ( "end_map", "end_array" ):
+                    depth -= 1
+                if depth == 0:
+                    values[path] = builder.value
+                    del active[path]
+                else:
+                    active[path] = [ builder, depth ]
+            path = targets.get( prefix )
+            if path is not None and path not in values and path not in active:
+                if event in ( "start_map", "start_array" ):
+                    builder = ijson.ObjectBuilder()
+                    builder.event( event, value )
+                    active[path] = [ builder, 1 ]
+                elif event not in ( "map_key", "end_map", "end_array" ):
+                    values[path] = value
+            if len( values ) == len( targets ):
+                # Everything requested has been read; skip the remainder of the file
+                break
+    for path in paths:
+        if path not in values:
+            raise KeyError( f"Probe path '{path}' not found in {probe_filename}" )
+    return values
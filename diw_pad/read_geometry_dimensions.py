@@ -8,4 +8,14 @@ def main( subdir ):
     platen_width = float( fDataLine[2] )
     top_platen_y_probe = float( fDataLine[3] )
     f.close()
-    return pad_height, pad_volume_ratio, platen_width, top_platen_y_probe
\ No newline at end of file
+    return pad_height, pad_volume_ratio, platen_width, top_platen_y_probe
+
+def cell_multiplicity( subdir ):
+    # Number of unit cells the modeled geometry stands for; files written before unit-cell models have no such column
+    f = open( os.path.join( subdir, "pad_dimensions.txt" ), "r" )
+    fLines = f.readlines()
+    fDataLine = fLines[1].strip().split( "," )
+    f.close()
+    if len( fDataLine ) < 5:
+        return 1
+    return int( fDataLine[4] )
\ No newline at end of file
@@ -1,54 +1,191 @@
 import os
 import numpy as np
-import scipy as sp
-from scipy import optimize
-from scipy import integrate
 import json
-from matplotlib import pyplot as plt
+import atexit
+import concurrent.futures
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-def main( eng_strain, eng_stress, savedir=os.getcwd() ):
-    plot_data( eng_strain, eng_stress, savedir )
+class PlotRenderer:
+    """Renders figures to files on a background thread pool with the non-interactive Agg canvas.
+    Figures are never registered with pyplot, so nothing is kept alive after a render completes."""
+    def __init__( self, enabled=True, max_workers=1 ):
+        # One worker by default: matplotlib is not guaranteed to be thread-safe across concurrent renders
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self.pool = None
+        self.futures = []
+
+    def submit( self, function, *args ):
+        if not self.enabled:
+            return None
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor( max_workers=self.max_workers, thread_name_prefix="plot" )
+            atexit.register( self.shutdown )
+        future = self.pool.submit( function, *args )
+        self.futures.append( future )
+        return future
+
+    def wait( self ):
+        # Re-raises the first rendering error, if any
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def shutdown( self ):
+        if self.pool is not None:
+            self.wait()
+            self.pool.shutdown()
+            self.pool = None
+
+renderer = PlotRenderer()
+
+def main( eng_strain, eng_stress, savedir=os.getcwd(), plot=True ):
     fit_results = fit_simulation_data( eng_strain, eng_stress )
-    plot_fit( fit_results, savedir )
+    if plot and savedir != None:
+        renderer.submit( plot_data, eng_strain, eng_stress, savedir )
+        renderer.submit( plot_fit, fit_results, savedir )
     return fit_results
 
-def compression_region_fit(x, c1 ):
-        y = c1 * x
-        return y
+def new_figure():
+    fig = Figure()
+    FigureCanvasAgg( fig )
+    return fig, fig.add_subplot()
 
-def compaction_region_fit( x, a, b ):
-    y = a * np.exp( b * x )
-    return y
+def save_figure( fig, filename ):
+    try:
+        fig.savefig( filename )
+    finally:
+        fig.clear()
 
-def fit_simulation_data( eng_strain, eng_stress ):
+def fit_simulation_data( eng_strain, eng_stress, num_candidates=500, num_refinements=3 ):
+    eng_strain = np.asarray( eng_strain, dtype=float )
+    eng_stress = np.asarray( eng_stress, dtype=float )
     sim_data_interp = lambda x: np.interp( x=x, xp=eng_strain, fp=eng_stress )
     min_dens_strain = eng_strain[1]
     max_dens_strain = eng_strain[-2]
-    bounds = [min_dens_strain, max_dens_strain]
-    dens_strain = sp.optimize.minimize_scalar( lambda x: fit_obj_fun( x, eng_strain, eng_stress, sim_data_interp ), method="bounded", bounds=bounds )
-    fit_results = fit_eval( dens_strain.x, eng_strain, eng_stress, sim_data_interp )
+    # Every candidate breakpoint is scored at once; the grid is then refined around the best one
+    candidates = np.union1d( np.linspace( min_dens_strain, max_dens_strain, num_candidates ), eng_strain[1:-1] )
+    for refinement in range( 0, num_refinements + 1 ):
+        objective = fit_objective( candidates, eng_strain, eng_stress )
+        best = int( np.argmin( objective ) )
+        dens_strain = candidates[best]
+        lower = candidates[max( best - 1, 0 )]
+        upper = candidates[min( best + 1, len( candidates ) - 1 )]
+        candidates = np.linspace( lower, upper, 51 )
+    fit_results = fit_eval( dens_strain, eng_strain, eng_stress, sim_data_interp )
     return fit_results
 
-def fit_obj_fun( dens_strain, eng_strain, eng_stress, sim_data_interp ):
-        fit = fit_eval( dens_strain, eng_strain, eng_stress, sim_data_interp )
-        compression_res = fit["compression_fit"]["res"]
-        compression_l2_norm = fit["compression_fit"]["l2_norm"]
-        compaction_res = fit["compaction_fit"]["res"]
-        compaction_l2_norm = fit["compaction_fit"]["l2_norm"]
-        fit_obj_val = ( compression_res / compression_l2_norm ) + ( compaction_res / compaction_l2_norm )
-        return fit_obj_val
+def fit_objective( dens_strains, eng_strain, eng_stress ):
+    fit = fit_regions( dens_strains, eng_strain, eng_stress )
+    return ( fit["compression_res"] / fit["compression_l2_norm"] ) + ( fit["compaction_res"] / fit["compaction_l2_norm"] )
+
+def fit_regions( dens_strains, eng_strain, eng_stress ):
+    # Least-squares fits on either side of each breakpoint and exact integrals of the piecewise-linear
+    # interpolant and of its squared difference from each fit, for an array of breakpoints
+    dens_strains = np.atleast_1d( np.asarray( dens_strains, dtype=float ) )
+    x = eng_strain[None, :]
+    y = eng_stress[None, :]
+    filter_compression = x <= dens_strains[:, None]
+    filter_compaction = x >= dens_strains[:, None]
+
+    # y = c1 * x has the closed-form least-squares slope sum( x * y ) / sum( x^2 )
+    c1 = np.sum( filter_compression * x * y, axis=1 ) / np.sum( filter_compression * x**2, axis=1 )
+    a, b = fit_exponential( eng_strain, eng_stress, filter_compaction )
+
+    zeros = np.zeros_like( dens_strains )
+    # np.interp holds eng_stress[0] below eng_strain[0]
+    clamp_length = max( eng_strain[0], 0.0 )
+    f2_below = eng_stress[0]**2 * clamp_length
+    xf_below = eng_stress[0] * clamp_length**2 / 2.0
+    f2, xf, _ = segment_integrals( eng_strain, eng_stress, zeros + clamp_length, dens_strains, zeros )
+    compression_l2_norm = f2 + f2_below
+    compression_res = compression_l2_norm - 2.0 * c1 * ( xf + xf_below ) + c1**2 * dens_strains**3 / 3.0
+
+    f2, _, f_exp = segment_integrals( eng_strain, eng_stress, dens_strains, zeros + eng_strain[-1], b )
+    compaction_l2_norm = f2
+    compaction_res = compaction_l2_norm - 2.0 * a * f_exp + a**2 * exp_integral( 2.0 * b, dens_strains, eng_strain[-1] )
+    return { "compression_coeffs": c1, "compaction_coeffs": ( a, b ),
+             "compression_l2_norm": compression_l2_norm, "compression_res": np.maximum( compression_res, 0.0 ),
+             "compaction_l2_norm": compaction_l2_norm, "compaction_res": np.maximum( compaction_res, 0.0 ) }
+
+def segment_integrals( eng_strain, eng_stress, lower, upper, b ):
+    # Integrals over [ lower, upper ] of f^2, x * f and f * exp( b * x ) for the linear interpolant f, per breakpoint.
+    # Every data segment is clipped to the interval, so each term is an exact integral of (linear) x (linear or exponential).
+    x0 = np.clip( eng_strain[None, :-1], lower[:, None], upper[:, None] )
+    x1 = np.clip( eng_strain[None, 1:], lower[:, None], upper[:, None] )
+    slope = np.diff( eng_stress ) / np.diff( eng_strain )
+    f0 = eng_stress[None, :-1] + slope[None, :] * ( x0 - eng_strain[None, :-1] )
+    f1 = eng_stress[None, :-1] + slope[None, :] * ( x1 - eng_strain[None, :-1] )
+    h = x1 - x0
+    f2 = np.sum( h * ( f0**2 + f0 * f1 + f1**2 ) / 3.0, axis=1 )
+    xf = np.sum( h * ( x0 * ( 2.0 * f0 + f1 ) + x1 * ( f0 + 2.0 * f1 ) ) / 6.0, axis=1 )
+    # Antiderivative of ( f0 + m ( x - x0 ) ) exp( b x ) is exp( b x ) ( f( x ) / b - m / b^2 ); trapezoidal limit as b -> 0
+    b = b[:, None]
+    small = np.abs( b ) < 1e-8
+    safe_b = np.where( small, 1.0, b )
+    m = slope[None, :]
+    exact = np.exp( safe_b * x1 ) * ( f1 / safe_b - m / safe_b**2 ) - np.exp( safe_b * x0 ) * ( f0 / safe_b - m / safe_b**2 )
+    f_exp = np.sum( np.where( small, h * ( f0 + f1 ) / 2.0, exact ), axis=1 )
+    return f2, xf, f_exp
+
+def exp_integral( b, lower, upper ):
+    small = np.abs( b ) < 1e-8
+    safe_b = np.where( small, 1.0, b )
+    return np.where( small, upper - lower, ( np.exp( safe_b * upper ) - np.exp( safe_b * lower ) ) / safe_b )
+
+def fit_exponential( eng_strain, eng_stress, mask, num_iterations=50 ):
+    # Least-squares y = a * exp( b * x ) over the masked points of every row at once: a y^2-weighted
+    # log-linear fit as the initial guess, then damped Gauss-Newton
+    x = np.broadcast_to( eng_strain, mask.shape )
+    y = np.broadcast_to( eng_stress, mask.shape )
+    w = mask * ( y > 0.0 ) * y**2
+    log_y = np.log( np.where( y > 0.0, y, 1.0 ) )
+    sw, swx, swxx = np.sum( w, axis=1 ), np.sum( w * x, axis=1 ), np.sum( w * x**2, axis=1 )
+    swy, swxy = np.sum( w * log_y, axis=1 ), np.sum( w * x * log_y, axis=1 )
+    det = sw * swxx - swx**2
+    valid = det > 0.0
+    det = np.where( valid, det, 1.0 )
+    b = np.where( valid, ( sw * swxy - swx * swy ) / det, 0.0 )
+    a = np.where( valid, np.exp( ( swxx * swy - swx * swxy ) / det ), np.maximum( np.sum( mask * y, axis=1 ) / np.maximum( np.sum( mask, axis=1 ), 1 ), 1e-12 ) )
+    sse = lambda a, b: np.sum( mask * ( y - a[:, None] * np.exp( b[:, None] * x ) )**2, axis=1 )
+    damping = np.full( a.shape, 1e-3 )
+    error = sse( a, b )
+    for iteration in range( 0, num_iterations ):
+        e = np.exp( b[:, None] * x )
+        r = mask * ( y - a[:, None] * e )
+        ja = mask * e
+        jb = mask * a[:, None] * x * e
+        jaa, jab, jbb = np.sum( ja * ja, axis=1 ), np.sum( ja * jb, axis=1 ), np.sum( jb * jb, axis=1 )
+        ga, gb = np.sum( ja * r, axis=1 ), np.sum( jb * r, axis=1 )
+        jaa_d, jbb_d = jaa * ( 1.0 + damping ), jbb * ( 1.0 + damping )
+        det = jaa_d * jbb_d - jab**2
+        det = np.where( np.abs( det ) > 0.0, det, 1.0 )
+        a_new = a + ( jbb_d * ga - jab * gb ) / det
+        b_new = b + ( jaa_d * gb - jab * ga ) / det
+        error_new = sse( a_new, b_new )
+        improved = np.isfinite( error_new ) & ( error_new < error )
+        a = np.where( improved, a_new, a )
+        b = np.where( improved, b_new, b )
+        error = np.where( improved, error_new, error )
+        damping = np.where( improved, damping / 10.0, damping * 10.0 )
+        if np.all( damping > 1e8 ):
+            # No row has improved for several iterations
+            break
+    return a, b
 
 def fit_eval( dens_strain, eng_strain, eng_stress, sim_data_interp ):
     filter_compression = eng_strain <= dens_strain
     filter_compaction = eng_strain >= dens_strain
-    compression_coeffs, _ = sp.optimize.curve_fit( compression_region_fit, eng_strain[filter_compression], eng_stress[filter_compression] )
-    compaction_coeffs, _ = sp.optimize.curve_fit( compaction_region_fit, eng_strain[filter_compaction], eng_stress[filter_compaction] )
+    fit = fit_regions( [ dens_strain ], eng_strain, eng_stress )
+    compression_coeffs = np.array( [ fit["compression_coeffs"][0] ] )
+    compaction_coeffs = np.array( [ fit["compaction_coeffs"][0][0], fit["compaction_coeffs"][1][0] ] )
     compression_fit_func = lambda x: compression_coeffs[0] * x
     compaction_fit_func = lambda x: compaction_coeffs[0] * np.exp( compaction_coeffs[1] * x )
-    compression_l2_norm, _ = sp.integrate.quad( lambda x: sim_data_interp(x)**2.0, 0.0, dens_strain, limit=int( 1e6 ) )
-    compaction_l2_norm, _ = sp.integrate.quad( lambda x: sim_data_interp(x)**2.0, dens_strain, eng_strain[-1], limit=int( 1e6 ) )
-    compression_res, _ = sp.integrate.quad( lambda x: ( sim_data_interp(x) - compression_fit_func(x) )**2.0, 0.0, dens_strain, limit=int( 1e6 ) )
-    compaction_res, _ = sp.integrate.quad( lambda x: ( sim_data_interp(x) - compaction_fit_func(x) )**2.0, dens_strain, eng_strain[-1], limit=int( 1e6 ) )
+    compression_l2_norm = float( fit["compression_l2_norm"][0] )
+    compaction_l2_norm = float( fit["compaction_l2_norm"][0] )
+    compression_res = float( fit["compression_res"][0] )
+    compaction_res = float( fit["compaction_res"][0] )
     compression_fit = { "filter": filter_compression, "coeffs": compression_coeffs, "fit_func": compression_fit_func, "l2_norm": compression_l2_norm, "res": compression_res, "domain": [0.0, dens_strain] }
     compaction_fit = { "filter": filter_compaction, "coeffs": compaction_coeffs, "fit_func": compaction_fit_func, "l2_norm": compaction_l2_norm, "res": compaction_res, "domain": [dens_strain, eng_strain[-1]] }
     sim_data = { "eng_strain":eng_strain, "eng_stress": eng_stress, "interp_func": sim_data_interp }
@@ -56,13 +193,13 @@ def fit_eval( dens_strain, eng_strain, eng_stress, sim_data_interp ):
     return fit_results
 
 def plot_data( eng_strain, eng_stress, savedir=None ):
-    fig, ax = plt.subplots()
+    fig, ax = new_figure()
     ax.set_xlabel( "Engineering strain" )
     ax.set_ylabel( "Engineering stress (kPa)" )
     ax.plot( eng_strain, eng_stress, marker="o" )
     if savedir != None:
-        plt.savefig( os.path.join( savedir, "diw_force_disp.png" ) )
-    
+        save_figure( fig, os.path.join( savedir, "diw_force_disp.png" ) )
+
 def plot_fit( fit_results, savedir=None ):
     eng_strain = fit_results["sim_data"]["eng_strain"]
     eng_stress = fit_results["sim_data"]["eng_stress"]
@@ -72,7 +209,7 @@ def plot_fit( fit_results, savedir=None ):
     x_compaction = np.linspace( compaction_domain[0], compaction_domain[1], int( 1e3 ) )
     compression_fit_func = fit_results["compression_fit"]["fit_func"]
     compaction_fit_func = fit_results["compaction_fit"]["fit_func"]
-    fig, ax = plt.subplots()
+    fig, ax = new_figure()
     ax.set_xlabel( "Engineering strain" )
     ax.set_ylabel( "Engineering stress (kPa)" )
     ax.plot( eng_strain, eng_stress, label="Simulation Data" )
@@ -80,4 +217,4 @@ def plot_fit( fit_results, savedir=None ):
     ax.plot( x_compaction,  compaction_fit_func( x_compaction ), label="Compaction Fit" )
     ax.legend( loc="upper left" )
     if savedir != None:
-        plt.savefig( os.path.join( savedir, "diw_force_disp_fit.png" ) )
+        save_figure( fig, os.path.join( savedir, "diw_force_disp_fit.png" ) )
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import atexit
+import numpy
+
+# Stand-in for the Cubit and Flex Python bindings, shared by every example's coreform_utils, which only import it when
+# COREFORM_BACKEND=mock. Commands are recorded rather than executed, so a driver run measures its own orchestration
+# cost; every Flex job writes a synthetic probe file.
+#   COREFORM_MOCK_LATENCY      seconds spent in every cmd() call (default 0)
+#   COREFORM_MOCK_JOB_LATENCY  seconds spent in every "job ... wait" (default 0)
+#   COREFORM_MOCK_STATS        file that receives command counts and timings at exit
+num_history_steps = 11
+
+def env_float( name, default=0.0 ):
+    return float( os.environ.get( name, default ) )
+
+class MockBackend:
+    def __init__( self, name ):
+        self.name = name
+        self.latency = env_float( "COREFORM_MOCK_LATENCY" )
+        self.commands = []
+        self.command_time = 0.0
+
+    def init( self, *args, **kwargs ):
+        return True
+
+    def cmd( self, command ):
+        start_time = time.perf_counter()
+        self.commands.append( command )
+        if self.latency > 0.0:
+            time.sleep( self.latency )
+        self.execute( command )
+        self.command_time += time.perf_counter() - start_time
+        return True
+
+    def execute( self, command ):
+        pass
+
+    def stats( self ):
+        keywords = {}
+        for command in self.commands:
+            keyword = command.split( maxsplit=1 )[0] if command.strip() else ""
+            keywords[keyword] = keywords.get( keyword, 0 ) + 1
+        return { "num_commands": len( self.commands ), "command_time": self.command_time, "commands_by_keyword": keywords }
+
+class MockEntity:
+    # Volumes fill this fraction of their bounding box, so volume ratios behave like those of a real porous part
+    fill_fraction = 0.5
+
+    def __init__( self, box, radius=1.0 ):
+        # box is [ xmin, ymin, zmin, xmax, ymax, zmax ]
+        self.box = box
+        self.radius = radius
+
+    def bounding_box( self ):
+        return list( self.box )
+
+    def volume( self ):
+        return self.fill_fraction * float( numpy.prod( numpy.subtract( self.box[3:], self.box[:3] ) ) )
+
+    def center_point( self ):
+        return tuple( ( numpy.add( self.box[:3], self.box[3:] ) / 2.0 ).tolist() )
+
+    def position_from_u_v( self, u, v ):
+        return self.center_point()
+
+    def principal_curvatures( self, point ):
+        return ( 1.0 / self.radius, 0.0 )
+
+    def closest_point_trimmed( self, point ):
+        return tuple( numpy.clip( point, self.box[:3], self.box[3:] ).tolist() )
+
+class MockCubit( MockBackend ):
+    """Every geometry-creating command adds one entity of each type; entity i is the unit cube stacked at y = i - 1,
+    so ids, bounding boxes and volumes are consistent without any real geometry. Entities created by a command with a
+    radius (a cylinder) curve with that radius, so radius-based surface lookups find them."""
+    creating_keywords = ( "brick", "bri", "create", "cylinder", "copy", "webcut", "sweep", "import", "section", "unite", "subtract", "split" )
+    entity_types = ( "volume", "body", "surface", "curve", "vertex" )
+
+    def __init__( self ):
+        super().__init__( "cubit" )
+        self.execute( "reset" )
+
+    def execute( self, command ):
+        words = command.lower().split()
+        if len( words ) == 0:
+            return
+        if words[0] == "reset":
+            self.last_ids = { entity_type: 0 for entity_type in self.entity_types }
+            self.radii = {}
+        elif words[0] in self.creating_keywords:
+            for entity_type in self.entity_types:
+                self.last_ids[entity_type] += 1
+            if "radius" in words[:-1]:
+                self.radii[self.last_ids["surface"]] = float( words[words.index( "radius" ) + 1] )
+
+    def get_last_id( self, entity_type ):
+        return self.last_ids[entity_type]
+
+    def get_entities( self, entity_type ):
+        return list( range( 1, self.last_ids[entity_type] + 1 ) )
+
+    def entity( self, entity_id ):
+        return MockEntity( [ 0.0, entity_id - 1.0, 0.0, 1.0, float( entity_id ), 1.0 ], self.radii.get( entity_id, 1.0 ) )
+
+    def volume( self, entity_id ):
+        return self.entity( entity_id )
+
+    def surface( self, entity_id ):
+        return self.entity( entity_id )
+
+    def curve( self, entity_id ):
+        return self.entity( entity_id )
+
+    def get_bounding_box( self, entity_type, entity_id ):
+        return self.get_total_bounding_box( entity_type, [ entity_id ] )
+
+    def get_total_bounding_box( self, entity_type, entity_ids ):
+        # [ xmin, xmax, xrange, ymin, ymax, yrange, zmin, zmax, zrange, diagonal ], as returned by Cubit
+        boxes = numpy.array( [ self.entity( entity_id ).box for entity_id in entity_ids ], dtype=float ).reshape( -1, 6 )
+        lower = boxes[:, :3].min( axis=0 ) if len( boxes ) > 0 else numpy.zeros( 3 )
+        upper = boxes[:, 3:].max( axis=0 ) if len( boxes ) > 0 else numpy.zeros( 3 )
+        bbox = []
+        for d in range( 0, 3 ):
+            bbox += [ lower[d], upper[d], upper[d] - lower[d] ]
+        return [ float( value ) for value in bbox ] + [ float( numpy.linalg.norm( upper - lower ) ) ]
+
+    def get_surface_type( self, entity_id ):
+        return "cone surface"
+
+    def get_error_count( self ):
+        return 0
+
+class MockFlex( MockBackend ):
+    """Tracks probe definitions, output procedures and job directories from the model-tree commands, and writes
+    cf_iga_data_output.json with ramped histories for every defined probe when a job is waited on."""
+    def __init__( self ):
+        super().__init__( "flex" )
+        self.job_latency = env_float( "COREFORM_MOCK_JOB_LATENCY" )
+        self.num_jobs = 0
+        self.execute( "reset" )
+
+    def version_short( self ):
+        return "mock"
+
+    def shutdown( self ):
+        pass
+
+    def execute( self, command ):
+        words = command.split()
+        if len( words ) == 0:
+            return
+        if words[0] == "reset":
+            self.probes = {}
+            self.procedures = []
+            self.working_dir = None
+            self.root_dir = None
+        elif words[0] == "playback":
+            with open( unquote( command.split( maxsplit=1 )[1] ) ) as journal_file:
+                for line in journal_file:
+                    if line.strip():
+                        self.execute( line.strip() )
+        elif words[0] == "save":
+            self.save_model( unquote( command.split( maxsplit=1 )[1] ) )
+        elif words[0] == "open":
+            self.open_model( unquote( command.split( maxsplit=1 )[1] ) )
+        elif words[0] == "root_dir":
+            self.root_dir = unquote( command.split( maxsplit=1 )[1] )
+        elif command.startswith( 'model_tree "job_manager queues local working_dir"' ):
+            self.working_dir = unquote( command.rsplit( " ", 1 )[1] )
+        elif words[0] == "procedures" and "outputs" in words and words[1] not in self.procedures:
+            self.procedures.append( words[1] )
+        elif words[:2] == [ "solid_mechanics_definitions", "probes" ] and len( words ) > 3:
+            self.define_probe( words[2], words[3:] )
+        elif words[0] == "job" and words[-1] == "wait":
+            if self.job_latency > 0.0:
+                time.sleep( self.job_latency )
+            self.write_probe_output()
+            self.num_jobs += 1
+
+    def save_model( self, filename ):
+        # A saved model holds what a later job needs, so that a model reopened in another process still writes its probes
+        with open( filename, "w" ) as model_file:
+            json.dump( { "mock_flex_model": { "probes": self.probes, "procedures": self.procedures } }, model_file )
+
+    def open_model( self, filename ):
+        # Geometry files are not written by the mock Cubit, so only models saved above replace the current state
+        try:
+            with open( filename ) as model_file:
+                model = json.load( model_file )["mock_flex_model"]
+        except ( OSError, ValueError, KeyError, TypeError ):
+            return
+        self.probes = { name: { **probe, "variables": [ tuple( variable ) for variable in probe["variables"] ] } for name, probe in model["probes"].items() }
+        self.procedures = model["procedures"]
+
+    def define_probe( self, name, words ):
+        probe = self.probes.setdefault( name, { "kind": "field", "extremum": False, "variables": [] } )
+        if words[0] == "integrated_surface_quantity":
+            probe["kind"] = "integrated"
+        if words[:2] == [ "field", "extremum" ]:
+            probe["extremum"] = True
+        match = re.search( r"variables (\S+) \d+ (\S+)$", " ".join( words ) )
+        if match is not None and match.groups() not in probe["variables"]:
+            probe["variables"].append( match.groups() )
+
+    def output_dir( self ):
+        if self.working_dir is not None:
+            return self.working_dir
+        if self.root_dir is not None:
+            return os.path.join( self.root_dir, "jobs" )
+        return os.getcwd()
+
+    def probe_histories( self ):
+        # Displacements ramp towards -y and +x/+z so that both pulled and compressed models see physically signed
+        # histories; integrated quantities stiffen so that fitted curves have some shape
+        ramp = numpy.linspace( 0.0, 1.0, num_history_steps )
+        histories = {}
+        for name, probe in self.probes.items():
+            values = {}
+            for variable, component in probe["variables"]:
+                sign = -1.0 if variable == "displacement" and component == "y" else 1.0
+                if probe["kind"] == "integrated":
+                    history = ( ramp * ( 1.0 + 4.0 * ramp**4 ) ).tolist()
+                elif probe["extremum"]:
+                    history = ramp.tolist()
+                else:
+                    history = [ [ sign * value ] for value in ramp ]
+                values.setdefault( variable, {} )[component] = history
+            histories[name] = { "extremum": values } if probe["extremum"] else values
+        return histories
+
+    def write_probe_output( self ):
+        output_dir = self.output_dir()
+        os.makedirs( output_dir, exist_ok=True )
+        histories = self.probe_histories()
+        probe_data = { procedure: { "history": histories } for procedure in self.procedures }
+        with open( os.path.join( output_dir, "cf_iga_data_output.json" ), "w" ) as probe_file:
+            json.dump( probe_data, probe_file )
+
+    def stats( self ):
+        stats = super().stats()
+        stats["num_jobs"] = self.num_jobs
+        return stats
+
+def unquote( text ):
+    return text.strip().strip( "\"'" )
+
+backends = {}
+start_time = time.perf_counter()
+
+def write_stats():
+    stats_filename = os.environ.get( "COREFORM_MOCK_STATS" )
+    if stats_filename is None:
+        return
+    stats = { name: backend.stats() for name, backend in backends.items() }
+    stats["elapsed"] = time.perf_counter() - start_time
+    with open( stats_filename, "w" ) as stats_file:
+        json.dump( stats, stats_file, indent=2 )
+
+atexit.register( write_stats )
+
+def import_cubit( verbose=False ):
+    if "cubit" not in backends:
+        backends["cubit"] = MockCubit()
+    return backends["cubit"]
+
+def import_flex( verbose=False ):
+    if "flex" not in backends:
+        backends["flex"] = MockFlex()
+    return backends["flex"]
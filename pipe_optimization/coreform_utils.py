@@ -1,7 +1,25 @@
 import os
+import math
+import re
 import sys
+import glob
+import shutil
+import time
+import atexit
+import asyncio
+import functools
+import threading
+import itertools
+import concurrent.futures
 import pathlib
 
+if os.environ.get( "COREFORM_BACKEND", "" ).lower() == "mock":
+    # The mock backend lives at the top of the repository, shared by every example
+    sys.path.append( os.path.dirname( os.path.dirname( os.path.realpath( __file__ ) ) ) )
+    import mock_coreform
+else:
+    mock_coreform = None
+
 def mk_script_relative( filepath ):
     path_to_this_script = os.path.dirname( os.path.realpath( filepath ) )
     def script_relative( relpath ):
@@ -9,6 +27,8 @@ def mk_script_relative( filepath ):
     return script_relative
 
 def import_cubit( verbose=False ):
+    if mock_coreform is not None:
+        return mock_coreform.import_cubit( verbose )
     if "win" in sys.platform:
         path_to_cubit = r"C:\Program Files\Coreform Cubit 2024.5\bin"
     elif "lin" in sys.platform:
@@ -22,6 +42,8 @@ def import_cubit( verbose=False ):
     return cubit
 
 def import_flex( verbose=False ):
+    if mock_coreform is not None:
+        return mock_coreform.import_flex( verbose )
     if "win" in sys.platform:
         path_to_flex = r"C:\Program Files\Coreform Flex 2024.5\bin"
         sys.path.append( path_to_flex )
@@ -31,4 +53,334 @@ def import_flex( verbose=False ):
         sys.path.append( path_to_flex )
         from coreform import flex
     flex.init( verbose )
-    return flex
\ No newline at end of file
+    return flex
+
+class CoreformSession:
+    """Long-lived Cubit/Flex instances for one worker process, reset (not re-initialized) between evaluations."""
+    def __init__( self ):
+        self._cubit = None
+        self._flex = None
+        self._jobs = None
+        self._warm_start = None
+        self.timings = { "cubit_init": 0.0, "flex_init": 0.0, "cubit_reset": [], "flex_reset": [] }
+        self.worker_timings = {}
+
+    def cubit( self, verbose=False ):
+        if self._cubit is None:
+            start_time = time.perf_counter()
+            self._cubit = import_cubit( verbose )
+            self.timings["cubit_init"] = time.perf_counter() - start_time
+        return self._cubit
+
+    def flex( self, verbose=False ):
+        if self._flex is None:
+            start_time = time.perf_counter()
+            self._flex = import_flex( verbose )
+            self.timings["flex_init"] = time.perf_counter() - start_time
+            atexit.register( self.exit_flex )
+        return self._flex
+
+    def jobs( self ):
+        if self._jobs is None:
+            self._jobs = FlexJobManager( self )
+        return self._jobs
+
+    def warm_start( self ):
+        if self._warm_start is None:
+            self._warm_start = WarmStart()
+        return self._warm_start
+
+    def reset_cubit( self, verbose=False ):
+        cubit = self.cubit( verbose )
+        start_time = time.perf_counter()
+        cubit.cmd( "reset" )
+        self.timings["cubit_reset"].append( time.perf_counter() - start_time )
+        return cubit
+
+    def reset_flex( self, verbose=False ):
+        flex = self.flex( verbose )
+        start_time = time.perf_counter()
+        flex.cmd( "reset" )
+        self.timings["flex_reset"].append( time.perf_counter() - start_time )
+        return flex
+
+    def exit_flex( self ):
+        if self._flex is not None:
+            self._flex.shutdown()
+            self._flex = None
+
+    def timings_snapshot( self ):
+        # Returned from worker processes, so that the parent can report their sessions with add_worker_timings
+        return os.getpid(), { name: list( value ) if isinstance( value, list ) else value for name, value in self.timings.items() }
+
+    def add_worker_timings( self, snapshot ):
+        pid, timings = snapshot
+        if pid == os.getpid():
+            return
+        # Snapshots are cumulative, so the one with the most resets is the latest from that worker
+        previous = self.worker_timings.get( pid )
+        if previous is None or num_resets( timings ) >= num_resets( previous ):
+            self.worker_timings[pid] = timings
+
+    def timing_summary( self ):
+        return summarize_timings( self.timings )
+
+    def print_timings( self ):
+        sessions = [ ( "main", self.timings ) ] + [ ( f"worker {pid}", timings ) for pid, timings in sorted( self.worker_timings.items() ) ]
+        for name, timings in sessions:
+            for product, summary in summarize_timings( timings ).items():
+                if summary["init_time"] == 0.0 and summary["num_resets"] == 0:
+                    # This process never started that product
+                    continue
+                print( f"{name} {product}: init {summary['init_time']:.3f} s, {summary['num_resets']} reset(s) totalling {summary['total_reset_time']:.3f} s (mean {summary['mean_reset_time']:.3f} s)" )
+
+def summarize_timings( timings ):
+    summary = {}
+    for product in ( "cubit", "flex" ):
+        resets = timings[f"{product}_reset"]
+        summary[product] = { "init_time": timings[f"{product}_init"],
+                             "num_resets": len( resets ),
+                             "total_reset_time": sum( resets ),
+                             "mean_reset_time": sum( resets ) / len( resets ) if len( resets ) > 0 else 0.0 }
+    return summary
+
+def num_resets( timings ):
+    return len( timings["cubit_reset"] ) + len( timings["flex_reset"] )
+
+class FlexJobManager:
+    """Submits Flex jobs and waits for them, either blocking or awaitable from asyncio.
+    Awaitable calls run on a single dedicated thread so the Flex binding is never entered concurrently."""
+    def __init__( self, session ):
+        self.session = session
+        self.executor = None
+        self.job_times = []
+
+    def submit( self, jobname, working_dir=None ):
+        flex = self.session.flex()
+        if working_dir is not None:
+            flex.cmd( f'model_tree "job_manager queues local working_dir" "{working_dir}"' )
+        flex.cmd( f'job {jobname} submit' )
+
+    def wait( self, jobname ):
+        self.session.flex().cmd( f'job {jobname} wait' )
+
+    def run( self, jobname, working_dir=None ):
+        start_time = time.perf_counter()
+        self.submit( jobname, working_dir )
+        self.wait( jobname )
+        self.job_times.append( ( jobname, time.perf_counter() - start_time ) )
+
+    async def call( self, function, *args ):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=1, thread_name_prefix="flex" )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor( self.executor, functools.partial( function, *args ) )
+
+    async def run_async( self, jobname, working_dir=None ):
+        await self.call( self.run, jobname, working_dir )
+
+
+class CommandBatch:
+    """Accumulates Flex model-tree commands and submits them in bulk: as a single journal playback when given a journal
+    directory, which is what the drivers do by default, otherwise one by one with per-command timings."""
+    def __init__( self, name="flex_commands" ):
+        self.name = name
+        self.commands = []
+        self.command_times = []
+        self.submit_time = 0.0
+        self.journal_filename = None
+
+    def cmd( self, command ):
+        self.commands.append( command )
+
+    def write_journal( self, journal_dir ):
+        journal_filename = pathlib.Path( os.path.join( journal_dir, f"{self.name}.jou" ) ).as_posix()
+        with open( journal_filename, "w" ) as journal_file:
+            journal_file.write( "\n".join( self.commands ) + "\n" )
+        self.journal_filename = journal_filename
+        return journal_filename
+
+    def submit( self, flex, journal_dir=None ):
+        self.command_times = []
+        start_time = time.perf_counter()
+        if journal_dir is None:
+            for command in self.commands:
+                cmd_start_time = time.perf_counter()
+                flex.cmd( command )
+                self.command_times.append( time.perf_counter() - cmd_start_time )
+        else:
+            # One round trip through the Python binding instead of one per command; a batch
+            # that is submitted repeatedly (e.g. a model template) is only written out once
+            if self.journal_filename is None:
+                self.write_journal( journal_dir )
+            flex.cmd( f'playback "{self.journal_filename}"' )
+        self.submit_time = time.perf_counter() - start_time
+
+    def timing_summary( self ):
+        summary = { "num_commands": len( self.commands ), "total_time": self.submit_time }
+        if len( self.command_times ) > 0:
+            slowest_id = max( range( len( self.command_times ) ), key=lambda i: self.command_times[i] )
+            summary["mean_command_time"] = sum( self.command_times ) / len( self.command_times )
+            summary["slowest_command_time"] = self.command_times[slowest_id]
+            summary["slowest_command"] = self.commands[slowest_id]
+        return summary
+
+    def print_timings( self ):
+        summary = self.timing_summary()
+        print( f"{self.name}: {summary['num_commands']} command(s) submitted in {summary['total_time']:.3f} s" )
+        if "slowest_command" in summary:
+            print( f"{self.name}: mean {summary['mean_command_time']:.2e} s per command, slowest {summary['slowest_command_time']:.2e} s: {summary['slowest_command']}" )
+
+class EvaluationContext:
+    """Where one evaluation lives: its work directory, id and output files. Passed explicitly so that
+    no evaluation depends on the process working directory or on module-level counters."""
+    def __init__( self, work_dir, eval_id, files=None ):
+        self.work_dir = pathlib.Path( os.path.abspath( work_dir ) ).as_posix()
+        self.eval_id = eval_id
+        self.files = dict( files ) if files is not None else {}
+
+    def path( self, filename ):
+        return pathlib.Path( os.path.join( self.work_dir, filename ) ).as_posix()
+
+    def file( self, key ):
+        return self.path( self.files[key] )
+
+    def make_work_dir( self ):
+        os.makedirs( self.work_dir, exist_ok=True )
+        return self.work_dir
+
+class EvaluationContextFactory:
+    def __init__( self, top_wd, base_name, files=None ):
+        self.top_wd = top_wd
+        self.base_name = base_name
+        self.files = files
+        self.ids = itertools.count( 1 )
+        self.lock = threading.Lock()
+
+    def new_context( self ):
+        with self.lock:
+            eval_id = next( self.ids )
+        return EvaluationContext( os.path.join( self.top_wd, f"{self.base_name}_{eval_id}" ), eval_id, self.files )
+
+class WarmStart:
+    """Hands the displacement results of the previous solve in this process to the next one, as the initial guess of an
+    iterative linear solver, and tracks how many solver iterations that saves. Every command that depends on the Flex
+    iterative-solver syntax is emitted from here."""
+    def __init__( self ):
+        self.solver_name = "warm_start_cg"
+        self.relative_tolerance = 1e-10
+        self.maximum_iterations = 5000
+        self.previous_results = None
+        self.next_results = None
+        self.solve_kind = None
+        self.iterations = { "cold": [], "warm": [] }
+
+    def solver_commands( self, batch, results_database ):
+        # Returns the solver name for the time stepper; the first solve starts from zero to give the cold reference
+        batch.cmd( f'linear_equation_solvers {self.solver_name} new' )
+        batch.cmd( f'linear_equation_solvers {self.solver_name} iterative conjugate_gradient' )
+        batch.cmd( f'linear_equation_solvers {self.solver_name} iterative preconditioner algebraic_multigrid' )
+        batch.cmd( f'linear_equation_solvers {self.solver_name} iterative relative_tolerance {self.relative_tolerance}' )
+        batch.cmd( f'linear_equation_solvers {self.solver_name} iterative maximum_iterations {self.maximum_iterations}' )
+        if self.previous_results is None:
+            self.solve_kind = "cold"
+        else:
+            batch.cmd( f'linear_equation_solvers {self.solver_name} iterative initial_guess database "{self.previous_results}"' )
+            self.solve_kind = "warm"
+        self.next_results = results_database
+        return self.solver_name
+
+    def record( self, work_dir ):
+        # Keep a copy of the results that just finished, since the next solve may overwrite them in place
+        iteration_count = read_iteration_count( work_dir )
+        if iteration_count is not None and self.solve_kind is not None:
+            self.iterations[self.solve_kind].append( iteration_count )
+        copy_dir = os.path.join( os.path.dirname( self.next_results ), "warm_start" )
+        os.makedirs( copy_dir, exist_ok=True )
+        for filename in glob.glob( f"{self.next_results}*" ):
+            if os.path.isfile( filename ):
+                shutil.copy( filename, copy_dir )
+        self.previous_results = pathlib.Path( os.path.join( copy_dir, os.path.basename( self.next_results ) ) ).as_posix()
+        self.solve_kind = None
+
+    def summary( self ):
+        cold, warm = self.iterations["cold"], self.iterations["warm"]
+        summary = { "num_cold": len( cold ), "num_warm": len( warm ) }
+        if len( cold ) > 0 and len( warm ) > 0:
+            summary["mean_cold_iterations"] = sum( cold ) / len( cold )
+            summary["mean_warm_iterations"] = sum( warm ) / len( warm )
+            summary["iterations_saved"] = len( warm ) * summary["mean_cold_iterations"] - sum( warm )
+        return summary
+
+    def print_summary( self ):
+        summary = self.summary()
+        print( f"Warm start: {summary['num_cold']} cold and {summary['num_warm']} warm solve(s) with a reported iteration count" )
+        if "iterations_saved" in summary:
+            print( f"Warm start: mean {summary['mean_cold_iterations']:.1f} cold vs {summary['mean_warm_iterations']:.1f} warm iterations, {summary['iterations_saved']:.0f} iteration(s) saved" )
+
+def read_iteration_count( work_dir ):
+    # Last linear-solver iteration count reported in the job logs of work_dir, or None when no log reports one
+    iteration_count = None
+    for log_filename in sorted( glob.glob( os.path.join( work_dir, "**", "*.log" ), recursive=True ) ):
+        with open( log_filename, errors="ignore" ) as log_file:
+            for match in re.finditer( r"(\d+)\s+iterations", log_file.read() ):
+                iteration_count = int( match.group( 1 ) )
+    return iteration_count
+
+class SolverStrategy:
+    """Chooses the linear equation solver for a discretization from an estimate of its size: the direct LU the examples
+    have always used while the factorization fits in memory, otherwise a preconditioned Krylov solver."""
+    def __init__( self, mode="auto", memory_fraction=0.5, concurrent_solves=1, symmetric=True ):
+        self.mode = mode
+        self.memory_limit = memory_fraction * physical_memory() / max( int( concurrent_solves ), 1 )
+        self.symmetric = symmetric
+        self.relative_tolerance = 1e-10
+        self.maximum_iterations = 5000
+
+    def estimate_dofs( self, lengths, element_sizes, degree, volume_fraction=1.0, dofs_per_node=3 ):
+        # A rectilinear spline space has elements + degree functions per direction; immersed cells that
+        # miss the part are dropped, which volume_fraction accounts for
+        num_functions = 1
+        for length, element_size in zip( lengths, element_sizes ):
+            num_functions *= math.ceil( length / element_size ) + degree
+        return int( dofs_per_node * volume_fraction * num_functions )
+
+    def estimate_direct_memory( self, num_dofs, degree ):
+        # Nested-dissection fill of a 3D operator grows like n^(4/3), with a stencil of ( 2 * degree + 1 )^3 functions
+        return 8.0 * ( 2 * degree + 1 )**2 * num_dofs**( 4.0 / 3.0 )
+
+    def choose( self, num_dofs, degree ):
+        if self.mode != "auto":
+            return self.mode
+        if self.estimate_direct_memory( num_dofs, degree ) <= self.memory_limit:
+            return "direct"
+        return "iterative"
+
+    def solver_commands( self, batch, name, num_dofs, degree ):
+        # Defines linear equation solver `name` and returns the kind that was chosen
+        kind = self.choose( num_dofs, degree )
+        print( f"{name}: ~{num_dofs} DOFs, estimated direct factorization {self.estimate_direct_memory( num_dofs, degree ) / 1024**3:.1f} GB of {self.memory_limit / 1024**3:.1f} GB, using {kind} solver" )
+        batch.cmd( f'linear_equation_solvers {name} new' )
+        if kind == "direct":
+            batch.cmd( f'linear_equation_solvers {name} direct lu' )
+        else:
+            krylov_method = "conjugate_gradient" if self.symmetric else "gmres"
+            batch.cmd( f'linear_equation_solvers {name} iterative {krylov_method}' )
+            batch.cmd( f'linear_equation_solvers {name} iterative preconditioner algebraic_multigrid' )
+            batch.cmd( f'linear_equation_solvers {name} iterative relative_tolerance {self.relative_tolerance}' )
+            batch.cmd( f'linear_equation_solvers {name} iterative maximum_iterations {self.maximum_iterations}' )
+        return kind
+
+def physical_memory():
+    try:
+        return os.sysconf( "SC_PAGE_SIZE" ) * os.sysconf( "SC_PHYS_PAGES" )
+    except ( ValueError, OSError, AttributeError ):
+        return 16 * 1024**3
+
+_session = None
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = CoreformSession()
+    return _session
@@ -0,0 +1,65 @@
+import os
+import json
+import numpy
+
+import make_cad
+
+design_names = [ "pipe_thickness", "pipe_length", "trunnion_inner_radius", "trunnion_thickness", "outer_fillet_radius", "inner_fillet_radius" ]
+
+class FeasibilityScreen:
+    """Distance-weighted nearest-neighbor classifier over past geom_success outcomes, used to skip designs
+    whose neighborhood in the (normalized) design space has consistently failed in Cubit."""
+    def __init__( self, history_file=None, num_neighbors=5, min_samples=10, reject_probability=0.8 ):
+        self.history_file = history_file
+        self.num_neighbors = num_neighbors
+        self.min_samples = min_samples
+        self.reject_probability = reject_probability
+        self.lower = numpy.array( [ make_cad.lower_params[name] for name in design_names ], dtype=float )
+        self.upper = numpy.array( [ make_cad.upper_params[name] for name in design_names ], dtype=float )
+        self.designs = []
+        self.outcomes = []
+        self.num_rejected = 0
+        self.load()
+
+    def normalize( self, x ):
+        scale = numpy.where( self.upper > self.lower, self.upper - self.lower, 1.0 )
+        return ( numpy.asarray( x, dtype=float ) - self.lower ) / scale
+
+    def failure_probability( self, x ):
+        num_failures = len( self.outcomes ) - sum( self.outcomes )
+        if len( self.outcomes ) < self.min_samples or num_failures == 0:
+            return None
+        X = self.normalize( numpy.array( self.designs ) )
+        failed = 1.0 - numpy.array( self.outcomes, dtype=float )
+        dist = numpy.linalg.norm( X - self.normalize( x ), axis=1 )
+        k = min( self.num_neighbors, len( dist ) )
+        nearest = numpy.argpartition( dist, k - 1 )[:k]
+        weights = 1.0 / ( dist[nearest] + 1e-6 )
+        return float( numpy.sum( weights * failed[nearest] ) / numpy.sum( weights ) )
+
+    def is_feasible( self, x ):
+        probability = self.failure_probability( x )
+        if probability is not None and probability >= self.reject_probability:
+            self.num_rejected += 1
+            print( f"MODEL ERROR: predicted geometry failure probability {probability:.2f}" )
+            return False
+        return True
+
+    def record( self, x, geom_success ):
+        design = [ float( x[i] ) for i in range( 0, len( design_names ) ) ]
+        self.designs.append( design )
+        self.outcomes.append( bool( geom_success ) )
+        if self.history_file is not None:
+            with open( self.history_file, "a" ) as f:
+                f.write( json.dumps( { "x": design, "geom_success": bool( geom_success ) } ) + "\n" )
+
+    def load( self ):
+        if self.history_file is None or not os.path.exists( self.history_file ):
+            return
+        with open( self.history_file ) as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                entry = json.loads( line )
+                self.designs.append( entry["x"] )
+                self.outcomes.append( entry["geom_success"] )
@@ -1,8 +1,10 @@
 #!python
+import os
 import math
+import numpy
 import coreform_utils
 
-cubit = coreform_utils.import_cubit()
+ctx = coreform_utils.get_session()
 
 initial_params = {
                     "pipe_inner_radius": 60.0,
@@ -39,29 +41,32 @@ upper_params = {
 
 cub_file = "pipe.cub5"
 cf_file = "pipe.cf"
+eval_files = { "cub": cub_file, "cf": cf_file, "probe": "cf_iga_data_output.json" }
 
-def create_geom( params ):
-  cubit.cmd( "reset" )
+def create_geom( params, eval_ctx ):
+  cubit = ctx.reset_cubit()
   initial_error = cubit.get_error_count()
   create_main_pipe( params["pipe_inner_radius"], params["pipe_thickness"], params["pipe_length"] )
   create_support_trunnion( params["trunnion_inner_radius"], params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_thickness"], params["trunnion_length"] )
   cubit.cmd( "unite volume all" )
-  cid1 = find_fillet_curve( params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_inner_radius"] + params["trunnion_thickness"] )
-  cid2 = find_fillet_curve( params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_inner_radius"] )
+  curve_index = CurveIndex()
+  cid1 = find_fillet_curve( params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_inner_radius"] + params["trunnion_thickness"], curve_index )
+  cid2 = find_fillet_curve( params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_inner_radius"], curve_index )
   cubit.cmd( f"modify curve {cid1} blend radius {params['outer_fillet_radius']}" )
   cubit.cmd( f"modify curve {cid2} blend radius {params['inner_fillet_radius']}" )
-  assign_sets( params )
+  sets_assigned = assign_sets( params )
   volume = compute_volume()
-  cubit.cmd( f"save cub5 '{cub_file}' overwrite" )
-  cubit.cmd( f"export coreform '{cf_file}' overwrite")
+  cubit.cmd( f"save cub5 '{eval_ctx.file( 'cub' )}' overwrite" )
+  cubit.cmd( f"export coreform '{eval_ctx.file( 'cf' )}' overwrite")
   final_error = cubit.get_error_count()
-  if final_error == initial_error:
+  if final_error == initial_error and sets_assigned:
     geom_success = True
   else:
     geom_success = False
   return volume, geom_success
 
 def create_main_pipe( inner_radius, thickness, length ):
+  cubit = ctx.cubit()
   cubit.cmd( f"create Cylinder height {length} radius {inner_radius}" )
   vid_1 = cubit.get_last_id( "volume" )
   cubit.cmd( f"create Cylinder height {length} radius {inner_radius + thickness}" )
@@ -72,6 +77,7 @@ def create_main_pipe( inner_radius, thickness, length ):
   cubit.cmd( f"move volume {vid_2} z {length/2.0}" )
 
 def create_support_trunnion( inner_radius, trim_radius, thickness, length ):
+  cubit = ctx.cubit()
   cubit.cmd( f"create Cylinder height {length} radius {inner_radius}" )
   vid_1 = cubit.get_last_id( "volume" )
   cubit.cmd( f"create Cylinder height {length} radius {inner_radius + thickness}" )
@@ -86,8 +92,9 @@ def create_support_trunnion( inner_radius, trim_radius, thickness, length ):
   cubit.cmd( f"subtract volume {vid_3} from volume {vid_2}" )
 
 def assign_sets( params ):
+  cubit = ctx.cubit()
   cubit.cmd( "block 1 volume all" )
-  assign_inner_pressure_sideset( params["pipe_inner_radius"], params["pipe_length"] )
+  pressure_assigned = assign_inner_pressure_sideset( params["pipe_inner_radius"], params["pipe_length"] )
   cubit.cmd( f"sideset 2 surface with x_coord<0.001" )
   cubit.cmd( f"sideset 3 surface with y_coord<0.001" )
   cubit.cmd( f"sideset 4 surface with y_coord>{params['trunnion_length']-0.001}" )
@@ -100,13 +107,17 @@ def assign_sets( params ):
   cubit.cmd( "sideset 4 name 'ymax'" )
   cubit.cmd( "sideset 5 name 'zmin'" )
   cubit.cmd( "sideset 6 name 'zmax'" )
+  return pressure_assigned
 
 def assign_inner_pressure_sideset( inner_radius, length ):
+  # Returns False, leaving sideset 1 empty, when no cone surface of the pipe's inner radius is left to load
+  cubit = ctx.cubit()
   cx = math.sqrt( ( inner_radius**2.0 ) / 2.0 )
   cy = math.sqrt( ( inner_radius**2.0 ) / 2.0 )
   cz = length / 2.0
   S = cubit.get_entities( "surface" )
   min_dist = float( "inf" )
+  inner_surface_id = None
   for sid in S:
     surf_type = cubit.get_surface_type( sid )
     if surf_type == "cone surface":
@@ -117,30 +128,65 @@ def assign_inner_pressure_sideset( inner_radius, length ):
         if dist < min_dist:
           min_dist = dist
           inner_surface_id = sid
+  if inner_surface_id is None:
+    print( "MODEL ERROR: no inner pressure surface found" )
+    return False
   cubit.cmd( f"sideset 1 surface {inner_surface_id}" )
+  return True
 
-def find_fillet_curve( major_radius, minor_radius ):
+def find_fillet_curve( major_radius, minor_radius, curve_index=None ):
+  if curve_index is None:
+    curve_index = CurveIndex()
   cx = math.sqrt( ( minor_radius**2.0 ) / 2.0 )
   cy = math.sqrt( major_radius**2.0 - cx**2.0 )
   cz = math.sqrt( ( minor_radius**2.0 ) / 2.0 )
-  C = cubit.get_entities( "curve" )
-  min_dist = float( "inf" )
-  for cid in C:
-    curve = cubit.curve( cid )
-    x, y, z = curve.closest_point_trimmed( ( cx, cy, cz ) )
-    dist = math.sqrt( ( cx - x )**2 + ( cy - y )**2 + ( cz - z )**2 )
-    if dist < min_dist:
-      min_dist = dist
-      fillet_curve = cid
-  return fillet_curve
+  return curve_index.nearest_curve( ( cx, cy, cz ) )
+
+class CurveIndex:
+  """Curve bounding boxes, queried from Cubit once (one call per curve) and shared by the fillet searches
+  made before the topology next changes."""
+  def __init__( self ):
+    self.curve_ids = None
+    self.curve_lo = None
+    self.curve_hi = None
+
+  def build_curves( self ):
+    cubit = ctx.cubit()
+    self.curve_ids = numpy.array( cubit.get_entities( "curve" ), dtype=int )
+    boxes = numpy.array( [ cubit.get_bounding_box( "curve", int( cid ) ) for cid in self.curve_ids ], dtype=float ).reshape( -1, 10 )
+    self.curve_lo = boxes[:, [ 0, 3, 6 ] ]
+    self.curve_hi = boxes[:, [ 1, 4, 7 ] ]
+
+  def nearest_curve( self, point ):
+    cubit = ctx.cubit()
+    if self.curve_ids is None:
+      self.build_curves()
+    point = numpy.asarray( point, dtype=float )
+    # Distance to a curve's bounding box never exceeds the distance to the curve itself, so curves are visited
+    # nearest box first and the search stops once no remaining box can beat the best exact distance
+    box_dist = numpy.linalg.norm( numpy.maximum( numpy.maximum( self.curve_lo - point, point - self.curve_hi ), 0.0 ), axis=1 )
+    min_dist = float( "inf" )
+    nearest_id = None
+    for i in numpy.argsort( box_dist ):
+      if box_dist[i] >= min_dist:
+        break
+      cid = int( self.curve_ids[i] )
+      x, y, z = cubit.curve( cid ).closest_point_trimmed( tuple( point ) )
+      dist = math.sqrt( ( point[0] - x )**2 + ( point[1] - y )**2 + ( point[2] - z )**2 )
+      if dist < min_dist:
+        min_dist = dist
+        nearest_id = cid
+    return nearest_id
 
 def get_cone_surface_radius( sid ):
+  cubit = ctx.cubit()
   surface = cubit.surface( sid )
   cXYZ = surface.position_from_u_v( 0.5, 0.5 )
   radius = 1 / max( surface.principal_curvatures( cXYZ) )
   return radius
 
 def compute_volume():
+  cubit = ctx.cubit()
   V = cubit.get_entities( "volume" )
   volume = 0.0
   for vid in V:
@@ -148,4 +194,4 @@ def compute_volume():
   return volume
 
 if __name__ == "__coreformcubit__":
-  create_geom( initial_params )
+  create_geom( initial_params, coreform_utils.EvaluationContext( os.getcwd(), 0, eval_files ) )
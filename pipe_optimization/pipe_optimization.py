@@ -3,6 +3,8 @@
 import os
 import pathlib
 import argparse
+import multiprocessing
+import concurrent.futures
 import numpy
 import pandas
 pandas.set_option( 'display.max_columns', None )
@@ -15,7 +17,7 @@ import parmoo.searches
 import parmoo.acquisitions
 
 import coreform_utils
-cubit = coreform_utils.import_cubit()
+ctx = coreform_utils.get_session()
 
 import make_cad
 initial_params = make_cad.initial_params
@@ -23,16 +25,19 @@ lower_params = make_cad.lower_params
 upper_params = make_cad.upper_params
 
 import run_flex
+import feasibility
+import probe_results
+import result_store
 
 import logging
 logging.basicConfig(level=logging.INFO)
 
 # Define Globals
-sim_id = 0
 obj_id = 0
 sim_base_name = 'simulation'
 yield_stress = 700e6
 top_wd = pathlib.Path( os.getcwd() ).as_posix()
+eval_contexts = coreform_utils.EvaluationContextFactory( top_wd, sim_base_name, make_cad.eval_files )
 
 initial_params = {
                     "pipe_inner_radius": 60.0,
@@ -76,12 +81,28 @@ def cli_arguments( parser ):
     parser.add_argument( "--mesh-size", dest="mesh_size", type=float, default=10.0 )
     parser.add_argument( "--degree", dest="degree", type=int, default=int(3) )
     parser.add_argument( "-np", dest="np", type=int, default=int(1) )
+    parser.add_argument( "-nb", dest="nb", type=int, default=int(1), help="Number of designs simulated concurrently" )
+    parser.add_argument( "--feasibility-history", dest="feasibility_history", type=os.path.abspath, default="geometry_history.jsonl" )
+    parser.add_argument( "--no-flex-journal", dest="flex_journal", action="store_false", help="Send the Flex model setup one command at a time, timing each, instead of as one journal playback" )
+    parser.add_argument( "--linear-solver", dest="linear_solver", type=str, choices=["auto", "direct", "iterative"], default="auto", help="Linear solver; auto picks direct LU when its estimated memory fits" )
+    parser.add_argument( "--warm-start", dest="warm_start", action="store_true", help="Start each solve's iterative linear solver from the previous design's displacements" )
+    parser.add_argument( "--export-gradients", dest="export_gradients", action="store_true", help="Export finite-difference gradients of the stress and volume at the verified optimum" )
+    parser.add_argument( "--fd-step", dest="fd_step", type=float, default=0.01, help="Finite-difference step as a fraction of each design range" )
+    parser.add_argument( "--result-store", dest="result_store", type=os.path.abspath, default="result_store", help="Directory of the evaluation history shared across runs" )
     return parser.parse_args()
 
 global options
 options = cli_arguments( parser )
+# Opened in main, so that spawned batch workers importing this module do not each open the database
+store = None
+store_settings = ( "mesh_size", "degree", "np", "linear_solver", "warm_start" )
 
 def main( options ):
+    global store
+    if options.warm_start and options.nb > 1:
+        # Warm-start state lives in the process that solves, so pooled batch solves would never see it
+        parser.error( "--warm-start needs every solve in the main process; drop -nb" )
+    store = result_store.ResultStore( options.result_store )
     my_moop = parmoo.MOOP( parmoo.optimizers.GlobalGPS )
     my_moop.addDesign( { "name": "pipe_thickness",        "des_type": "continuous", "lb": lower_params["pipe_thickness"],        "ub": upper_params["pipe_thickness"],        "des_tol": 1e-6 } )
     my_moop.addDesign( { "name": "pipe_length",           "des_type": "continuous", "lb": lower_params["pipe_length"],           "ub": upper_params["pipe_length"],           "des_tol": 1e-6 } )
@@ -115,7 +136,15 @@ def main( options ):
     print("Constraint type:        " + str(con_dytpe))
 
     # Solve the MOOP
-    my_moop.solve( 20 )
+    pool = None
+    num_workers = get_num_workers( options )
+    if num_workers > 1:
+        # Spawn rather than fork so every worker initializes its own Cubit and Flex instances
+        mp_context = multiprocessing.get_context( "spawn" )
+        pool = concurrent.futures.ProcessPoolExecutor( max_workers=num_workers, mp_context=mp_context )
+        solve_batched( my_moop, 20, pool )
+    else:
+        my_moop.solve( 20 )
     
     # Collect Results
     results = my_moop.getPF(format='pandas')
@@ -128,20 +157,99 @@ def main( options ):
     print( obj_data )
 
     # Perform verification simulation of computed optimal result
-    os.chdir( top_wd )
     results = my_moop.getPF(format='ndarray')
-    max_mises_stress, volume, feasible_geom = run_flex.main( top_wd, results[0], options )
+    optimal_ctx = coreform_utils.EvaluationContext( top_wd, 0, make_cad.eval_files )
+    max_mises_stress, volume, feasible_geom = run_flex.main( optimal_ctx, results[0], options, run_flex.get_feasibility_screen( options ) )
     print( f"Optimal Max Mises Stress: {max_mises_stress}" ) 
+    if options.export_gradients and feasible_geom:
+        export_fd_gradients( optimal_ctx, results[0], max_mises_stress, volume, pool )
+    if pool is not None:
+        pool.shutdown()
+    store.close()
+    if options.warm_start:
+        ctx.warm_start().print_summary()
+    ctx.print_timings()
+    ctx.exit_flex()
+
+def solve_batched( my_moop, iter_max, pool ):
+    # Same iterate/update loop as MOOP.solve, except every new design point of an iteration is
+    # simulated in one parallel batch and stored in the database before parmoo asks for it
+    for k in range( 0, iter_max + 1 ):
+        batch = my_moop.iterate( k )
+        # A point proposed twice in one batch is simulated and stored once, as MOOP.solve's per-point database check would
+        pending = {}
+        for ( x, s_name ) in batch:
+            if my_moop.check_sim_db( x, s_name ) is None:
+                pending.setdefault( ( tuple( x ), s_name ), ( x, s_name ) )
+        pending = list( pending.values() )
+        sim_results = evaluate_batch( [ x for ( x, s_name ) in pending ], pool )
+        for ( x, s_name ), sx in zip( pending, sim_results ):
+            my_moop.update_sim_db( x, sx, s_name )
+        my_moop.updateAll( k, batch )
+
+def evaluate_batch( X, pool=None ):
+    eval_ctxs = [ eval_contexts.new_context() for x in X ]
+    designs = [ [ float( x[i] ) for i in range( 0, 6 ) ] for x in X ]
+    screen = run_flex.get_feasibility_screen( options )
+    if pool is None:
+        timed_results = [ run_flex.evaluate_timed( eval_ctxs[i], designs[i], options, screen ) for i in range( 0, len( X ) ) ]
+    else:
+        # Workers share no screen: the parent screens the batch, and alone appends the outcomes to the history file
+        accepted = [ i for i in range( 0, len( X ) ) if run_flex.prescreen( designs[i], screen ) ]
+        worker_results = pool.map( run_flex.evaluate_timed, [ eval_ctxs[i] for i in accepted ], [ designs[i] for i in accepted ], [ options ] * len( accepted ) )
+        timed_results = [ ( run_flex.infeasible_result, 0.0, ctx.timings_snapshot() ) ] * len( X )
+        for i, timed_result in zip( accepted, worker_results ):
+            timed_results[i] = timed_result
+            screen.record( designs[i], timed_result[0][2] )
+    for eval_ctx, design, ( sim_result, wall_time, snapshot ) in zip( eval_ctxs, designs, timed_results ):
+        ctx.add_worker_timings( snapshot )
+        record_evaluation( eval_ctx, design, sim_result, wall_time )
+    sim_results = [ sim_result for ( sim_result, wall_time, snapshot ) in timed_results ]
+    return numpy.array( sim_results, dtype=float ).reshape( len( X ), 3 )
+
+def record_evaluation( eval_ctx, x, sim_result, wall_time ):
+    max_mises_stress, volume, feasible_geom = sim_result
+    design = { name: float( x[i] ) for i, name in enumerate( feasibility.design_names ) }
+    settings = { name: getattr( options, name ) for name in store_settings }
+    # An infeasible design's stress and volume are run_flex's placeholders, not results
+    values = { "feasible_geom": float( feasible_geom ) }
+    histories = {}
+    if feasible_geom:
+        values.update( { "max_mises_stress": max_mises_stress, "volume": volume } )
+        histories = probe_results.read_probes( eval_ctx.file( "probe" ), [ run_flex.max_mises_stress_path ] )
+    store.record( "pipe_optimization", design, settings, values, histories, wall_time, "ok" if feasible_geom else "infeasible_geometry" )
+
+def export_fd_gradients( eval_ctx, x, max_mises_stress, volume, pool=None ):
+    # Forward differences of the stress and volume at x, with all perturbed designs simulated as one batch.
+    # A step that would leave the bounds is taken backwards; a perturbed design whose geometry fails gives a nan derivative.
+    x = numpy.array( [ float( x[i] ) for i in range( 0, len( feasibility.design_names ) ) ] )
+    lower = numpy.array( [ lower_params[name] for name in feasibility.design_names ] )
+    upper = numpy.array( [ upper_params[name] for name in feasibility.design_names ] )
+    steps = options.fd_step * ( upper - lower )
+    steps = numpy.where( x + steps <= upper, steps, -steps )
+    X = [ x + steps[d] * numpy.eye( len( x ) )[d] for d in range( 0, len( x ) ) ]
+    sim_results = evaluate_batch( X, pool )
+    feasible = sim_results[:, 2] > 0.5
+    stress_gradient = numpy.where( feasible, ( sim_results[:, 0] - max_mises_stress ) / steps, numpy.nan )
+    volume_gradient = numpy.where( feasible, ( sim_results[:, 1] - volume ) / steps, numpy.nan )
+    values = { run_flex.max_mises_stress_path: max_mises_stress, "volume": volume }
+    gradients = { run_flex.max_mises_stress_path: stress_gradient, "volume": volume_gradient }
+    gradient_filename = eval_ctx.path( probe_results.fd_gradients_filename )
+    probe_results.write_fd_gradients( gradient_filename, feasibility.design_names, x, values, gradients, options.fd_step )
+    for name, d_stress, d_volume in zip( feasibility.design_names, stress_gradient, volume_gradient ):
+        print( f"d(max mises stress)/d({name}): {d_stress}  d(volume)/d({name}): {d_volume}" )
+
+def get_num_workers( options ):
+    max_workers = max( 1, ( os.cpu_count() or 1 ) // max( options.np, 1 ) )
+    if max_workers < options.nb:
+        print( f"Limiting batch concurrency to {max_workers} design(s) ({options.np} core(s) per design)" )
+    return max( 1, min( options.nb, max_workers ) )
 
 def evaluate_iteration( x ):
-    global sim_id
-    sim_id += 1
-    eval_dir = f'{sim_base_name}_{sim_id}'
-    subdir = pathlib.Path( os.path.join(top_wd, eval_dir ) ).as_posix()
-    if not os.path.exists(subdir):
-        os.makedirs(subdir)
-    os.chdir(subdir)
-    max_mises_stress, volume, feasible_geom = run_flex.main( subdir, x, options )
+    eval_ctx = eval_contexts.new_context()
+    sim_result, wall_time, snapshot = run_flex.evaluate_timed( eval_ctx, x, options, run_flex.get_feasibility_screen( options ) )
+    record_evaluation( eval_ctx, x, sim_result, wall_time )
+    max_mises_stress, volume, feasible_geom = sim_result
     return max_mises_stress, volume, feasible_geom
 
 def compute_volume_length_ratio( x, sim ):
@@ -1,178 +1,226 @@
-import os
 import math
-import json
+import time
 import coreform_utils
+import probe_results
+ctx = coreform_utils.get_session()
 
 import make_cad
+import feasibility
 initial_params = make_cad.initial_params
 lower_params = make_cad.lower_params
 upper_params = make_cad.upper_params
+feasibility_screen = None
+# Stress, volume and geometry flag reported for designs rejected before any geometry is built
+infeasible_result = ( 1000, 1.0, False )
 
-def main( eval_dir, x, options ):
+def main( eval_ctx, x, options, screen=None ):
+    # screen is the learned FeasibilityScreen, which only the process that owns its history file passes in;
+    # pool workers get None and leave screening and recording to the parent
     cad_params = x_to_params( x )
-    if is_cad_feasible( cad_params ):
-        volume, geom_success = make_cad.create_geom( cad_params )
-        flex_commands( eval_dir, cad_params, options )
-        max_mises_stress = get_max_mises_stress( eval_dir )
+    if prescreen( x, screen ):
+        volume, geom_success = make_cad.create_geom( cad_params, eval_ctx )
+        if screen is not None:
+            screen.record( x, geom_success )
+        flex_commands( eval_ctx, cad_params, options, volume )
+        max_mises_stress = get_max_mises_stress( eval_ctx )
         return max_mises_stress, volume, geom_success
     else:
-        return 1000, 1.0, False
+        return infeasible_result
 
-def flex_commands( eval_dir, params, options ):
-    flex = coreform_utils.import_flex()
-    flex.cmd( 'reset' )
+def prescreen( x, screen=None ):
+    # Checks that cost no Cubit or Flex time: the analytic rules, then the learned screen
+    return is_cad_feasible( x_to_params( x ) ) and ( screen is None or screen.is_feasible( x ) )
 
-    cf_file = os.path.join( eval_dir, "pipe.cf" )
-    flex.cmd(f'open "{cf_file}"' )
+def get_feasibility_screen( options ):
+    global feasibility_screen
+    if feasibility_screen is None:
+        feasibility_screen = feasibility.FeasibilityScreen( getattr( options, "feasibility_history", None ) )
+    return feasibility_screen
+
+def evaluate( eval_ctx, x, options, screen=None ):
+    eval_ctx.make_work_dir()
+    return main( eval_ctx, x, options, screen )
+
+def evaluate_timed( eval_ctx, x, options, screen=None ):
+    start_time = time.perf_counter()
+    sim_result = evaluate( eval_ctx, x, options, screen )
+    return sim_result, time.perf_counter() - start_time, ctx.timings_snapshot()
+
+def flex_commands( eval_ctx, params, options, volume=None ):
+    flex = ctx.reset_flex()
+    batch = coreform_utils.CommandBatch( "pipe_setup" )
+
+    cf_file = eval_ctx.file( "cf" )
+    batch.cmd(f'open "{cf_file}"' )
 
     degree = options.degree
     mesh_size = options.mesh_size
 
-    flex.cmd(f'fill "fill_1" affine hatch_spacing [{mesh_size} {mesh_size} {mesh_size}] degree {degree} continuity {degree-1} padding [ {degree} {degree} {degree}]' )
-    flex.cmd( 'part 1 fill 1' )
-    flex.cmd( 'part 1 volume_box axis_aligned' )
+    batch.cmd(f'fill "fill_1" affine hatch_spacing [{mesh_size} {mesh_size} {mesh_size}] degree {degree} continuity {degree-1} padding [ {degree} {degree} {degree}]' )
+    batch.cmd( 'part 1 fill 1' )
+    batch.cmd( 'part 1 volume_box axis_aligned' )
 
     ### IGA PARAMS
-    flex.cmd( 'coreform_iga_version 2024.5' )
-    flex.cmd( 'label "internal_pressure"' )
-
-    flex.cmd( 'materials steel new' )
-    flex.cmd( 'materials steel mass_density 1' )
-    flex.cmd( 'materials steel elastic youngs_modulus 200e9' )
-    flex.cmd( 'materials steel elastic poissons_ratio 0.3' )
-    flex.cmd( 'materials steel elastic large_deformations false' )
-
-    flex.cmd( 'flex_models flex_immersed new' )
-    flex.cmd( 'flex_models flex_immersed database_name "geom"' )
-    flex.cmd( 'flex_models flex_immersed small_cell_volume_ratio 0.2' )
-
-    flex.cmd( 'flex_models flex_immersed parts pipe part "pipe"' )
-    flex.cmd( 'flex_models flex_immersed parts pipe material "steel"' )
-    flex.cmd( 'flex_models flex_immersed parts pipe material_model elastic' )
-    flex.cmd( 'flex_models flex_immersed parts pipe quadrature QP1' )
-
-    flex.cmd( 'functions constant_1 new' )
-    flex.cmd( 'functions constant_1 constant value 1.0' )
-
-    flex.cmd( 'functions linear_ramp new' )
-    flex.cmd( 'functions linear_ramp piecewise_linear abscissa [0 1]' )
-    flex.cmd( 'functions linear_ramp piecewise_linear ordinate [0 1]' )
-
-    flex.cmd( 'intervals push_interval new' )
-    flex.cmd( 'intervals push_interval start_time 0' )
-    flex.cmd( 'intervals push_interval stop_time 1' )
-
-    flex.cmd( 'time_steppers linear_statics new' )
-    flex.cmd( 'time_steppers linear_statics linear linear_equation_solver "direct_multifrontal"' )
-
-    flex.cmd( 'linear_equation_solvers direct_multifrontal new' )
-    flex.cmd( 'linear_equation_solvers direct_multifrontal direct lu' )
-
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry new' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement components 0 x' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement function "constant_1"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement scale_factor 0.0' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry set "xmin"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry penalty 200e12' )
-
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry new' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement components 0 y' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement function "constant_1"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement scale_factor 0.0' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry set "ymin"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry penalty 200e12' )
-
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion new' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 0 x' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 1 y' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 2 z' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement function "constant_1"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement scale_factor 0.0' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion set "ymax"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion penalty 200e12' )
-
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry new' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement components 0 z' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement function "constant_1"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement scale_factor 0.0' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry set "zmin"' )
-    flex.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry penalty 200e12' )
-
-    flex.cmd( 'solid_mechanics_definitions load_conditions pressure_load new' )
-    flex.cmd( 'solid_mechanics_definitions load_conditions pressure_load surface_pressure scale_factor 100e6' )
-    flex.cmd( 'solid_mechanics_definitions load_conditions pressure_load surface_pressure function "linear_ramp"' )
-    flex.cmd( 'solid_mechanics_definitions load_conditions pressure_load set "pressure_surface"' )
+    batch.cmd( 'coreform_iga_version 2024.5' )
+    batch.cmd( 'label "internal_pressure"' )
+
+    batch.cmd( 'materials steel new' )
+    batch.cmd( 'materials steel mass_density 1' )
+    batch.cmd( 'materials steel elastic youngs_modulus 200e9' )
+    batch.cmd( 'materials steel elastic poissons_ratio 0.3' )
+    batch.cmd( 'materials steel elastic large_deformations false' )
+
+    batch.cmd( 'flex_models flex_immersed new' )
+    batch.cmd( 'flex_models flex_immersed database_name "geom"' )
+    batch.cmd( 'flex_models flex_immersed small_cell_volume_ratio 0.2' )
+
+    batch.cmd( 'flex_models flex_immersed parts pipe part "pipe"' )
+    batch.cmd( 'flex_models flex_immersed parts pipe material "steel"' )
+    batch.cmd( 'flex_models flex_immersed parts pipe material_model elastic' )
+    batch.cmd( 'flex_models flex_immersed parts pipe quadrature QP1' )
+
+    batch.cmd( 'functions constant_1 new' )
+    batch.cmd( 'functions constant_1 constant value 1.0' )
+
+    batch.cmd( 'functions linear_ramp new' )
+    batch.cmd( 'functions linear_ramp piecewise_linear abscissa [0 1]' )
+    batch.cmd( 'functions linear_ramp piecewise_linear ordinate [0 1]' )
+
+    batch.cmd( 'intervals push_interval new' )
+    batch.cmd( 'intervals push_interval start_time 0' )
+    batch.cmd( 'intervals push_interval stop_time 1' )
+
+    linear_solver = "linear_solver"
+    if getattr( options, "warm_start", False ):
+        linear_solver = ctx.warm_start().solver_commands( batch, eval_ctx.path( "results" ) )
+    batch.cmd( 'time_steppers linear_statics new' )
+    batch.cmd(f'time_steppers linear_statics linear linear_equation_solver "{linear_solver}"' )
+
+    linear_solver_commands( batch, params, options, volume )
+
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry new' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement components 0 x' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement function "constant_1"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry displacement scale_factor 0.0' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry set "xmin"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions x_symmetry penalty 200e12' )
+
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry new' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement components 0 y' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement function "constant_1"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry displacement scale_factor 0.0' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry set "ymin"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions y_symmetry penalty 200e12' )
+
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion new' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 0 x' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 1 y' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement components 2 z' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement function "constant_1"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion displacement scale_factor 0.0' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion set "ymax"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions hold_trunnion penalty 200e12' )
+
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry new' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement components 0 z' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement function "constant_1"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry displacement scale_factor 0.0' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry set "zmin"' )
+    batch.cmd( 'solid_mechanics_definitions boundary_conditions z_symmetry penalty 200e12' )
+
+    batch.cmd( 'solid_mechanics_definitions load_conditions pressure_load new' )
+    batch.cmd( 'solid_mechanics_definitions load_conditions pressure_load surface_pressure scale_factor 100e6' )
+    batch.cmd( 'solid_mechanics_definitions load_conditions pressure_load surface_pressure function "linear_ramp"' )
+    batch.cmd( 'solid_mechanics_definitions load_conditions pressure_load set "pressure_surface"' )
 
     pull_load_area = ( ( math.pi * ( params["pipe_inner_radius"] + params["pipe_thickness"] )**2.0 ) - ( math.pi * params["pipe_inner_radius"]**2.0 ) ) / 4.0
     pull_load_uniform_pressure = -282e3 / pull_load_area
-    flex.cmd( 'solid_mechanics_definitions load_conditions pull_load new' )
-    flex.cmd( f'solid_mechanics_definitions load_conditions pull_load surface_pressure scale_factor {pull_load_uniform_pressure}' )
-    flex.cmd( 'solid_mechanics_definitions load_conditions pull_load surface_pressure function "linear_ramp"' )
-    flex.cmd( 'solid_mechanics_definitions load_conditions pull_load set "zmax"' )
-
-    flex.cmd( 'solid_mechanics_definitions outputs field_results new' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field database_name "results"' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field interval "push_interval"' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field part "pipe"' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 0 x' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 1 y' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 2 z' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field variables stress 0 all' )
-    flex.cmd( 'solid_mechanics_definitions outputs field_results field element_variable_output_strategy interpolate' )
-
-    flex.cmd( 'solid_mechanics_definitions outputs probe_results new' )
-    flex.cmd( 'solid_mechanics_definitions outputs probe_results history interval "push_interval"' )
-    flex.cmd( 'solid_mechanics_definitions outputs probe_results history probe_variables 0 "max_mises"' )
-    flex.cmd( 'solid_mechanics_definitions outputs probe_results history probe_variables 1 "load_reaction_force"' )
-
-    flex.cmd( 'solid_mechanics_definitions probes max_mises new' )
-    flex.cmd( 'solid_mechanics_definitions probes max_mises field extremum set "pipe"' )
-    flex.cmd( 'solid_mechanics_definitions probes max_mises field extremum maximum stress von_mises' )
-    flex.cmd( 'solid_mechanics_definitions probes max_mises field location_configuration reference' )
-    flex.cmd( 'solid_mechanics_definitions probes max_mises field field_variable_configuration reference' )
-    flex.cmd( 'solid_mechanics_definitions probes max_mises field variables stress 0 von_mises' )
-
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force new' )
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 0 x' )
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 1 y' )
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 2 z' )
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity use_set_from_load_condition "pull_load"' )
-    flex.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity part "pipe"' )
-
-    flex.cmd( 'procedures push new' )
-    flex.cmd( 'procedures push solid_mechanics flex_model "flex_immersed"' )
-    flex.cmd( 'procedures push solid_mechanics interval "push_interval"' )
-    flex.cmd( 'procedures push solid_mechanics time_stepping_method "linear_statics"' )
-    flex.cmd( 'procedures push solid_mechanics outputs 0 "field_results"' )
-    flex.cmd( 'procedures push solid_mechanics outputs 1 "probe_results"' )
-    flex.cmd( 'procedures push solid_mechanics load_conditions 0 "pressure_load"' )
-    flex.cmd( 'procedures push solid_mechanics load_conditions 1 "pull_load"' )
-    flex.cmd( 'procedures push solid_mechanics boundary_conditions 0 "x_symmetry"' )
-    flex.cmd( 'procedures push solid_mechanics boundary_conditions 1 "y_symmetry"' )
-    flex.cmd( 'procedures push solid_mechanics boundary_conditions 2 "hold_trunnion"' )
-    flex.cmd( 'procedures push solid_mechanics boundary_conditions 3 "z_symmetry"' )
-
-    flex.cmd(f'save "{cf_file}"' )
-    
-    flex.cmd(f'model_tree "job_manager queues local working_dir" "{eval_dir}"')
+    batch.cmd( 'solid_mechanics_definitions load_conditions pull_load new' )
+    batch.cmd( f'solid_mechanics_definitions load_conditions pull_load surface_pressure scale_factor {pull_load_uniform_pressure}' )
+    batch.cmd( 'solid_mechanics_definitions load_conditions pull_load surface_pressure function "linear_ramp"' )
+    batch.cmd( 'solid_mechanics_definitions load_conditions pull_load set "zmax"' )
+
+    batch.cmd( 'solid_mechanics_definitions outputs field_results new' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field database_name "results"' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field interval "push_interval"' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field part "pipe"' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 0 x' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 1 y' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field variables displacement 2 z' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field variables stress 0 all' )
+    batch.cmd( 'solid_mechanics_definitions outputs field_results field element_variable_output_strategy interpolate' )
+
+    batch.cmd( 'solid_mechanics_definitions outputs probe_results new' )
+    batch.cmd( 'solid_mechanics_definitions outputs probe_results history interval "push_interval"' )
+    batch.cmd( 'solid_mechanics_definitions outputs probe_results history probe_variables 0 "max_mises"' )
+    batch.cmd( 'solid_mechanics_definitions outputs probe_results history probe_variables 1 "load_reaction_force"' )
+
+    batch.cmd( 'solid_mechanics_definitions probes max_mises new' )
+    batch.cmd( 'solid_mechanics_definitions probes max_mises field extremum set "pipe"' )
+    batch.cmd( 'solid_mechanics_definitions probes max_mises field extremum maximum stress von_mises' )
+    batch.cmd( 'solid_mechanics_definitions probes max_mises field location_configuration reference' )
+    batch.cmd( 'solid_mechanics_definitions probes max_mises field field_variable_configuration reference' )
+    batch.cmd( 'solid_mechanics_definitions probes max_mises field variables stress 0 von_mises' )
+
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force new' )
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 0 x' )
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 1 y' )
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity variables reaction_force 2 z' )
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity use_set_from_load_condition "pull_load"' )
+    batch.cmd( 'solid_mechanics_definitions probes load_reaction_force integrated_surface_quantity part "pipe"' )
+
+    batch.cmd( 'procedures push new' )
+    batch.cmd( 'procedures push solid_mechanics flex_model "flex_immersed"' )
+    batch.cmd( 'procedures push solid_mechanics interval "push_interval"' )
+    batch.cmd( 'procedures push solid_mechanics time_stepping_method "linear_statics"' )
+    batch.cmd( 'procedures push solid_mechanics outputs 0 "field_results"' )
+    batch.cmd( 'procedures push solid_mechanics outputs 1 "probe_results"' )
+    batch.cmd( 'procedures push solid_mechanics load_conditions 0 "pressure_load"' )
+    batch.cmd( 'procedures push solid_mechanics load_conditions 1 "pull_load"' )
+    batch.cmd( 'procedures push solid_mechanics boundary_conditions 0 "x_symmetry"' )
+    batch.cmd( 'procedures push solid_mechanics boundary_conditions 1 "y_symmetry"' )
+    batch.cmd( 'procedures push solid_mechanics boundary_conditions 2 "hold_trunnion"' )
+    batch.cmd( 'procedures push solid_mechanics boundary_conditions 3 "z_symmetry"' )
+
+    batch.cmd(f'save "{cf_file}"' )
+
+    batch.submit( flex, journal_dir=eval_ctx.work_dir if options.flex_journal else None )
+    batch.print_timings()
 
     flex.cmd( 'job pipe_evaluation new' )
     flex.cmd( 'job pipe_evaluation simulation queue "local"' )
     flex.cmd( f'job pipe_evaluation simulation processor_count {int( options.np )}' )
-    flex.cmd( 'job pipe_evaluation submit' )
-    flex.cmd( 'job pipe_evaluation wait' )
-    flex.shutdown()
-
-def get_max_mises_stress( eval_dir ):
-    probe_filename = os.path.join( eval_dir, 'cf_iga_data_output.json' )
-    with open( probe_filename ) as probe_file:
-        output_data = json.load(probe_file)['push']
-        probe_data = output_data['history']
-        max_mises_stress = probe_data['max_mises']['extremum']['stress']['von_mises'][-1]
-    return max_mises_stress
+    ctx.jobs().run( 'pipe_evaluation', working_dir=eval_ctx.work_dir )
+    if getattr( options, "warm_start", False ):
+        ctx.warm_start().record( eval_ctx.work_dir )
+
+def linear_solver_commands( batch, params, options, volume=None ):
+    strategy = coreform_utils.SolverStrategy( getattr( options, "linear_solver", "auto" ), concurrent_solves=getattr( options, "nb", 1 ) )
+    degree = options.degree
+    mesh_size = options.mesh_size
+    # Hatched over the quarter pipe-and-trunnion bounding box; only cells that intersect the part carry DOFs,
+    # and the thin walls leave about as many partially filled cells as filled ones
+    lengths = [ params["pipe_inner_radius"] + params["pipe_thickness"], params["trunnion_length"], params["pipe_length"] ]
+    volume_fraction = 1.0
+    if volume is not None:
+        volume_fraction = min( 1.0, 2.0 * volume / ( lengths[0] * lengths[1] * lengths[2] ) )
+    num_dofs = strategy.estimate_dofs( lengths, [ mesh_size ] * 3, degree, volume_fraction )
+    strategy.solver_commands( batch, "linear_solver", num_dofs, degree )
+
+max_mises_stress_path = "push/history/max_mises/extremum/stress/von_mises"
+
+def get_max_mises_stress( eval_ctx ):
+    probe_filename = eval_ctx.file( "probe" )
+    max_mises_stress = probe_results.read_probes( probe_filename, [ max_mises_stress_path ] )[max_mises_stress_path][-1]
+    return float( max_mises_stress )
 
 def is_cad_feasible( params ):
-    if params["inner_fillet_radius"] >= 0.9 * ( params["trunnion_inner_radius"] ):
+    pipe_outer_radius = params["pipe_inner_radius"] + params["pipe_thickness"]
+    trunnion_outer_radius = params["trunnion_inner_radius"] + params["trunnion_thickness"]
+    if min( params[name] for name in feasibility.design_names ) <= 0.0:
+        print( "MODEL ERROR 0" )
+        return False
+    elif params["inner_fillet_radius"] >= 0.9 * ( params["trunnion_inner_radius"] ):
         print( "MODEL ERROR 1" )
         return False
     elif params["trunnion_inner_radius"] + params["trunnion_thickness"] >= 0.9 * ( params["pipe_inner_radius"] + params["pipe_thickness"] ):
@@ -181,6 +229,12 @@ def is_cad_feasible( params ):
     elif params["trunnion_inner_radius"] + params["trunnion_thickness"] + params["outer_fillet_radius"] >= 0.9 * ( params["pipe_length"] ):
         print( "MODEL ERROR 3" )
         return False
+    elif pipe_outer_radius * math.asin( trunnion_outer_radius / pipe_outer_radius ) + params["outer_fillet_radius"] >= 0.95 * math.pi * pipe_outer_radius / 2.0:
+        # Measured around the pipe from the trunnion axis, the trunnion wall reaches an arc length of R asin( r / R )
+        # and the outer blend about one fillet radius further; that must end before the ymin symmetry plane of the
+        # quarter model, a quarter circumference away
+        print( "MODEL ERROR 4" )
+        return False
     else:
         return True
     
@@ -0,0 +1,54 @@
+import os
+import json
+import hashlib
+import collections
+
+class EvaluationCache:
+    """Content-addressed LRU cache of simulation results, persisted to a JSON file."""
+    def __init__( self, filename=None, max_entries=256 ):
+        self.filename = filename
+        self.max_entries = max( int( max_entries ), 1 )
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def make_key( self, design, settings ):
+        key_data = { "design": [ float( value ) for value in design ],
+                     "settings": { name: settings[name] for name in sorted( settings ) } }
+        key_string = json.dumps( key_data, sort_keys=True )
+        return hashlib.sha256( key_string.encode( "utf-8" ) ).hexdigest()
+
+    def get( self, key ):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end( key )
+        return self.entries[key]
+
+    def put( self, key, value ):
+        self.entries[key] = value
+        self.entries.move_to_end( key )
+        while len( self.entries ) > self.max_entries:
+            self.entries.popitem( last=False )
+        self.save()
+
+    def load( self ):
+        if self.filename is None or not os.path.exists( self.filename ):
+            return
+        with open( self.filename ) as cache_file:
+            cache_data = json.load( cache_file )
+        for key, value in cache_data["entries"]:
+            self.entries[key] = value
+        while len( self.entries ) > self.max_entries:
+            self.entries.popitem( last=False )
+
+    def save( self ):
+        if self.filename is None:
+            return
+        # Write-then-rename so an interrupted optimizer never leaves a truncated cache behind
+        tmp_filename = f"{self.filename}.tmp"
+        with open( tmp_filename, "w" ) as cache_file:
+            json.dump( { "entries": list( self.entries.items() ) }, cache_file )
+        os.replace( tmp_filename, self.filename )
@@ -0,0 +1,53 @@
+import numpy
+
+class FiniteDifferenceGradient:
+    """Finite-difference Jacobian of a vector of outputs, from one batch of evaluations per point.
+    evaluate_batch( X ) returns a ( len( X ), num_outputs ) array and is free to run the points in parallel
+    and to serve already-solved points (such as the center) from a cache."""
+    def __init__( self, evaluate_batch, bounds, step=0.05, scheme="forward" ):
+        self.evaluate_batch = evaluate_batch
+        self.lower = numpy.array( [ bound[0] for bound in bounds ], dtype=float )
+        self.upper = numpy.array( [ bound[1] for bound in bounds ], dtype=float )
+        self.step = step
+        self.scheme = scheme
+        self.x = None
+        self.jacobian = None
+        self.num_batches = 0
+
+    def stencil( self, x ):
+        # Returns the batch of points and, per coordinate, the indices of the points and the spacing to difference over.
+        # Steps that would leave the bounds are flipped to the other side of the center point.
+        points = [ x ]
+        differences = []
+        for d in range( 0, len( x ) ):
+            forward = x.copy()
+            forward[d] = x[d] + self.step
+            backward = x.copy()
+            backward[d] = x[d] - self.step
+            fits_forward = forward[d] <= self.upper[d]
+            fits_backward = backward[d] >= self.lower[d]
+            if self.scheme == "central" and fits_forward and fits_backward:
+                points += [ forward, backward ]
+                differences.append( ( len( points ) - 2, len( points ) - 1, 2 * self.step ) )
+            elif fits_forward:
+                points.append( forward )
+                differences.append( ( len( points ) - 1, 0, self.step ) )
+            else:
+                points.append( backward )
+                differences.append( ( 0, len( points ) - 1, self.step ) )
+        return points, differences
+
+    def evaluate( self, x ):
+        x = numpy.asarray( x, dtype=float ).ravel()
+        if self.x is not None and numpy.array_equal( x, self.x ):
+            return self.jacobian
+        points, differences = self.stencil( x )
+        values = numpy.asarray( self.evaluate_batch( points ), dtype=float )
+        self.num_batches += 1
+        jacobian = numpy.empty( ( values.shape[1], len( x ) ) )
+        for d in range( 0, len( x ) ):
+            i_plus, i_minus, h = differences[d]
+            jacobian[:, d] = ( values[i_plus] - values[i_minus] ) / h
+        self.x = x
+        self.jacobian = jacobian
+        return jacobian
@@ -1,14 +1,22 @@
 #!python3
 
 import os
+import time
 import pathlib
 import argparse
+import multiprocessing
+import concurrent.futures
 import numpy
 import scipy
 from scipy import optimize
 import json
 import run_coreform_cubit
 import run_coreform_flex
+import evaluation_cache
+import surrogate
+import finite_difference
+import probe_results
+import result_store
 from coreform_utils import mk_script_relative
 
 parser = argparse.ArgumentParser( prog='PlateWithHoleOptimization' )
@@ -19,63 +27,196 @@ def cli_arguments( parser ):
     parser.add_argument( "--strategy", dest="strategy", type=str, choices=["bodyfit", "immersed"], default="immersed" )
     parser.add_argument( "--mesh-size", dest="mesh_size", type=float, default=4 )
     parser.add_argument( "--degree", dest="degree", type=int, default=4 )
+    parser.add_argument( "--no-flex-journal", dest="flex_journal", action="store_false", help="Send the Flex model setup one command at a time, timing each, instead of as one journal playback" )
+    parser.add_argument( "--linear-solver", dest="linear_solver", type=str, choices=["auto", "direct", "iterative"], default="auto", help="Linear solver; auto picks direct LU when its estimated memory fits" )
+    parser.add_argument( "--warm-start", dest="warm_start", action="store_true", help="Start each solve's iterative linear solver from the previous design's displacements" )
+    parser.add_argument( "--cache-file", dest="cache_file", type=str, default="evaluation_cache.json" )
+    parser.add_argument( "--cache-size", dest="cache_size", type=int, default=256 )
+    parser.add_argument( "--surrogate", dest="surrogate", action="store_true", help="Optimize on a Gaussian-process surrogate and only solve at infill points" )
+    parser.add_argument( "--max-solves", dest="max_solves", type=int, default=10, help="Solve budget of the surrogate mode" )
+    parser.add_argument( "-nj", dest="nj", type=int, default=1, help="Number of finite-difference gradient points solved concurrently" )
+    parser.add_argument( "--fd-step", dest="fd_step", type=float, default=0.05, help="Finite-difference step in radius" )
+    parser.add_argument( "--fd-scheme", dest="fd_scheme", type=str, choices=["forward", "central"], default="forward" )
+    parser.add_argument( "--result-store", dest="result_store", type=str, default="result_store", help="Directory of the evaluation history shared across runs" )
     return parser.parse_args()
 
 script_relative = mk_script_relative( __file__ )
 top_wd = pathlib.Path( os.getcwd() ).as_posix()
 log_file = "optimization_monitor.log"
 yield_stress = 36260 # PSI
+cache_settings = ( "strategy", "degree", "mesh_size", "nt", "ni" )
+displacement_path = "pull/history/disp_probe/displacement/x"
+stress_path = "pull/history/stress_probe/stress/max_principal"
+store_settings = cache_settings + ( "linear_solver", "warm_start" )
 
 def main( args ):
-    iga_args = { 'top_wd': top_wd, 'strategy': args.strategy, 'degree': int( args.degree ), 'mesh_size': float( args.mesh_size ), 'nt': args.nt, 'ni': args.ni }
-    obj_fun = lambda radius: evaluate_objective( radius, iga_args )
-    con_fun = lambda radius: evaluate_constraint( radius, iga_args )
-    constraint = ( {'type': 'ineq', 'fun': con_fun}, )
+    if args.warm_start and args.nj > 1 and not args.surrogate:
+        # Warm-start state lives in the process that solves, so pooled gradient solves would never see it
+        parser.error( "--warm-start needs every solve in the main process; drop -nj" )
+    iga_args = { 'top_wd': top_wd, 'strategy': args.strategy, 'degree': int( args.degree ), 'mesh_size': float( args.mesh_size ), 'nt': args.nt, 'ni': args.ni, 'flex_journal': args.flex_journal, 'warm_start': args.warm_start, 'linear_solver': args.linear_solver, 'concurrent_solves': 1 }
+    cache = evaluation_cache.EvaluationCache( os.path.join( top_wd, args.cache_file ), args.cache_size )
+    store = result_store.ResultStore( os.path.join( top_wd, args.result_store ) )
+    obj_fun = lambda radius: evaluate_objective( radius, iga_args, cache, store )
+    con_fun = lambda radius: evaluate_constraint( radius, iga_args, cache, store )
     bounds = ( (0.5, 24.5), )
-    local_opt_options = { "method": "trust-constr", "gtol":1e-1, "xtol":1e-1 }
-    global_opt_options = { "disp":True, "f_tol": 1e-3, "minimizer_kwargs":local_opt_options }
-    results = scipy.optimize.shgo( func=obj_fun, bounds=bounds, constraints=constraint, iters=2, options=global_opt_options )
+    if args.surrogate:
+        results = surrogate_optimize( obj_fun, con_fun, bounds, args.max_solves, iga_args, cache )
+    else:
+        pool = None
+        num_workers = get_num_workers( iga_args, args.nj )
+        iga_args["concurrent_solves"] = num_workers
+        if num_workers > 1:
+            pool = concurrent.futures.ProcessPoolExecutor( max_workers=num_workers, mp_context=multiprocessing.get_context( "spawn" ) )
+        # Objective and constraint Jacobians at a point come from a single batch of perturbed solves
+        gradient = finite_difference.FiniteDifferenceGradient( lambda X: evaluate_batch( X, iga_args, cache, pool, store ), bounds, step=args.fd_step, scheme=args.fd_scheme )
+        obj_jac = lambda radius: objective_jac( radius, gradient, iga_args, cache, store )
+        con_jac = lambda radius: constraint_jac( radius, gradient, iga_args, cache, store )
+        constraint = ( {'type': 'ineq', 'fun': con_fun, 'jac': con_jac}, )
+        local_opt_options = { "method": "trust-constr", "gtol":1e-1, "xtol":1e-1 }
+        global_opt_options = { "disp":True, "f_tol": 1e-3, "minimizer_kwargs":local_opt_options, "jac": obj_jac }
+        results = scipy.optimize.shgo( func=obj_fun, bounds=bounds, constraints=constraint, iters=2, options=global_opt_options )
+        if pool is not None:
+            pool.shutdown()
+        print( f"Finite-difference gradient batches: {gradient.num_batches}" )
     print( results )
+    print( f"Evaluation cache hits: {cache.hits} misses: {cache.misses}" )
+    store.close()
+    if args.warm_start:
+        run_coreform_flex.ctx.warm_start().print_summary()
+    run_coreform_flex.ctx.print_timings()
     run_coreform_flex.ctx.exit_flex()
 
-def evaluate_objective( radius, args ):
-    args["radius"] = radius[0]
+def surrogate_optimize( obj_fun, con_fun, bounds, max_solves, args, cache ):
+    optimizer = surrogate.SurrogateOptimizer( lambda radius: ( obj_fun( radius ), con_fun( radius ) ), bounds, max_solves=max_solves )
+    # Completed runs with the same discretization seed the surrogate without costing a solve
+    settings = { name: args[name] for name in cache_settings }
+    for result in cache.entries.values():
+        if result.get( "settings" ) == settings:
+            optimizer.add_sample( result["design"], objective_value( result["max_displacement"] ), constraint_value( result["max_stress"] ) )
+    return optimizer.minimize()
+
+def get_num_workers( args, nj ):
+    # Each solve runs trim and IGA one after the other, so it never holds more than max( nt, ni ) cores
+    cores_per_solve = max( args["nt"], args["ni"] )
+    max_workers = max( 1, ( os.cpu_count() or 1 ) // cores_per_solve )
+    if max_workers < nj:
+        print( f"Limiting gradient concurrency to {max_workers} solve(s) ({cores_per_solve} core(s) per solve)" )
+    return max( 1, min( nj, max_workers ) )
+
+def evaluate_batch( X, args, cache, pool=None, store=None ):
+    # Uncached points are solved concurrently, each in its own working directory; returns rows of [ max_displacement, max_stress ]
+    settings = { name: args[name] for name in cache_settings }
+    results = [ cache.get( cache.make_key( radius, settings ) ) for radius in X ]
+    pending = [ i for i in range( 0, len( X ) ) if results[i] is None ]
+    if pool is None:
+        for i in pending:
+            max_displacement, max_stress = evaluate_design( X[i], args, cache, store )
+            results[i] = { "max_displacement": max_displacement, "max_stress": max_stress }
+    else:
+        case_args = [ make_case_args( args, j, X[pending[j]] ) for j in range( 0, len( pending ) ) ]
+        for i, ( result, histories, wall_time, snapshot ) in zip( pending, pool.map( run_case, case_args ) ):
+            run_coreform_flex.ctx.add_worker_timings( snapshot )
+            results[i] = result
+            cache.put( cache.make_key( X[i], settings ), result )
+            record_result( store, args, result, histories, wall_time )
+    return numpy.array( [ [ result["max_displacement"], result["max_stress"] ] for result in results ] )
+
+def make_case_args( args, case_id, radius ):
+    case_wd = pathlib.Path( os.path.join( args["top_wd"], f"fd_case_{case_id}" ) ).as_posix()
+    if not os.path.exists( case_wd ):
+        os.mkdir( case_wd )
+    case_args = dict( args )
+    case_args["top_wd"] = case_wd
+    case_args["radius"] = float( radius[0] )
+    return case_args
+
+def run_case( args ):
+    start_time = time.perf_counter()
     run_coreform_cubit.main( args )
     run_coreform_flex.flex_commands( args )
-    max_displacement = get_max_displacement()
-    obj_value = 1.0 / max_displacement
+    probe_data = get_probe_data( args["top_wd"] )
+    result = { "max_displacement": float( probe_data[displacement_path][-1][-1] ), "max_stress": float( probe_data[stress_path][-1][-1] ),
+               "design": [ args["radius"] ], "settings": { name: args[name] for name in cache_settings } }
+    return result, probe_data, time.perf_counter() - start_time, run_coreform_flex.ctx.timings_snapshot()
+
+def evaluate_design( radius, args, cache, store=None ):
+    settings = { name: args[name] for name in cache_settings }
+    key = cache.make_key( radius, settings )
+    result = cache.get( key )
+    if result is None:
+        start_time = time.perf_counter()
+        args["radius"] = radius[0]
+        run_coreform_cubit.main( args )
+        run_coreform_flex.flex_commands( args )
+        result = { "max_displacement": get_max_displacement(), "max_stress": get_max_stress(),
+                   "design": [ float( value ) for value in radius ], "settings": settings }
+        cache.put( key, result )
+        record_result( store, args, result, get_probe_data(), time.perf_counter() - start_time )
+    return result["max_displacement"], result["max_stress"]
+
+def record_result( store, args, result, histories, wall_time ):
+    if store is None:
+        return
+    settings = { name: args[name] for name in store_settings }
+    values = { "max_displacement": result["max_displacement"], "max_stress": result["max_stress"] }
+    store.record( "plate_with_hole_optimization", { "radius": result["design"][0] }, settings, values, histories, wall_time )
+
+def probe_gradients( radius, gradient, args, cache, store=None ):
+    # Finite-difference derivatives of the probed quantities are written next to the probe output, then chained into
+    # the objective and constraint Jacobians
+    jacobian = gradient.evaluate( radius )
+    max_displacement, max_stress = evaluate_design( radius, args, cache, store )
+    values = { displacement_path: max_displacement, stress_path: max_stress }
+    gradients = { displacement_path: jacobian[0], stress_path: jacobian[1] }
+    gradient_filename = os.path.join( args["top_wd"], probe_results.fd_gradients_filename )
+    probe_results.write_fd_gradients( gradient_filename, [ "radius" ], radius, values, gradients, gradient.step )
+    return values, gradients
+
+def objective_jac( radius, gradient, args, cache, store=None ):
+    values, gradients = probe_gradients( radius, gradient, args, cache, store )
+    return -1.0 * gradients[displacement_path] / values[displacement_path]**2
+
+def constraint_jac( radius, gradient, args, cache, store=None ):
+    values, gradients = probe_gradients( radius, gradient, args, cache, store )
+    return -1.0 * gradients[stress_path][None, :]
+
+def objective_value( max_displacement ):
+    return 1.0 / max_displacement
+
+def constraint_value( max_stress ):
+    return -1.0 * ( max_stress - yield_stress )
+
+def evaluate_objective( radius, args, cache, store=None ):
+    max_displacement, _ = evaluate_design( radius, args, cache, store )
+    obj_value = objective_value( max_displacement )
     fLog = open( log_file, "a+" )
-    fLog.write( f"Radius: {args['radius']}\n" )
+    fLog.write( f"Radius: {radius[0]}\n" )
     fLog.write( f"Max Displacement: {max_displacement}\n" )
     fLog.write( f"Objective Value: {obj_value}\n" )
     fLog.close()
     return obj_value
 
-def evaluate_constraint( radius, args ):
-    args["radius"] = radius[0]
-    run_coreform_cubit.main( args )
-    run_coreform_flex.flex_commands( args )
-    max_stress = get_max_stress()
-    con_value = -1.0 * ( max_stress - yield_stress )
+def evaluate_constraint( radius, args, cache, store=None ):
+    _, max_stress = evaluate_design( radius, args, cache, store )
+    con_value = constraint_value( max_stress )
     fLog = open( log_file, "a+" )
     fLog.write( f"Max Stress: {max_stress}\n" )
     fLog.write( f"Constraint Value: {con_value}\n" )
     fLog.close()
     return con_value
 
-def get_max_displacement():
-    probe_filename = pathlib.Path( os.path.join( top_wd, "cf_iga_data_output.json" ) ).as_posix()
-    with open( probe_filename ) as probe_file:
-        probe_data = json.load( probe_file )['pull']['history']
-        max_displacement = probe_data['disp_probe']['displacement']['x'][-1][-1]
-    return max_displacement
-
-def get_max_stress():
-    probe_filename = pathlib.Path( os.path.join( top_wd, "cf_iga_data_output.json" ) ).as_posix()
-    with open( probe_filename ) as probe_file:
-        probe_data = json.load( probe_file )['pull']['history']
-        max_stress = probe_data['stress_probe']['stress']['max_principal'][-1][-1]
-    return max_stress
+def get_probe_data( workdir=top_wd ):
+    # Both quantities are requested together so the output file is parsed once per evaluation
+    probe_filename = pathlib.Path( os.path.join( workdir, "cf_iga_data_output.json" ) ).as_posix()
+    return probe_results.read_probes( probe_filename, [ displacement_path, stress_path ] )
+
+def get_max_displacement( workdir=top_wd ):
+    max_displacement = get_probe_data( workdir )[displacement_path][-1][-1]
+    return float( max_displacement )
+
+def get_max_stress( workdir=top_wd ):
+    max_stress = get_probe_data( workdir )[stress_path][-1][-1]
+    return float( max_stress )
 
 if __name__ == '__main__':
     main( cli_arguments( parser ) )
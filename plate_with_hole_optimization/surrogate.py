@@ -0,0 +1,146 @@
+import numpy
+import scipy
+from scipy import linalg
+from scipy import optimize
+from scipy import stats
+
+class GaussianProcess:
+    """Zero-mean Gaussian process with a squared-exponential kernel on inputs scaled to the unit box.
+    The length scale is picked from a grid by maximum (profile) marginal likelihood at every fit."""
+    def __init__( self, lower, upper, nugget=1e-8 ):
+        self.lower = numpy.asarray( lower, dtype=float )
+        self.upper = numpy.asarray( upper, dtype=float )
+        self.nugget = nugget
+        self.length_scales = numpy.logspace( -2, 1, 31 )
+
+    def scale( self, X ):
+        return ( numpy.atleast_2d( numpy.asarray( X, dtype=float ) ) - self.lower ) / ( self.upper - self.lower )
+
+    def kernel( self, A, B, length_scale ):
+        sq_dist = numpy.sum( ( A[:, None, :] - B[None, :, :] )**2, axis=2 )
+        return numpy.exp( -0.5 * sq_dist / length_scale**2 )
+
+    def fit( self, X, y ):
+        self.X = self.scale( X )
+        y = numpy.asarray( y, dtype=float )
+        self.y_mean = numpy.mean( y )
+        self.y_std = numpy.std( y ) if numpy.std( y ) > 0 else 1.0
+        z = ( y - self.y_mean ) / self.y_std
+        n = len( z )
+        best_lml = -numpy.inf
+        for length_scale in self.length_scales:
+            K = self.kernel( self.X, self.X, length_scale ) + self.nugget * numpy.eye( n )
+            try:
+                L = linalg.cholesky( K, lower=True )
+            except linalg.LinAlgError:
+                continue
+            alpha = linalg.cho_solve( ( L, True ), z )
+            variance = max( float( z @ alpha ) / n, 1e-12 )
+            lml = -0.5 * n * numpy.log( variance ) - numpy.sum( numpy.log( numpy.diag( L ) ) )
+            if lml > best_lml:
+                best_lml = lml
+                self.length_scale = length_scale
+                self.variance = variance
+                self.L = L
+                self.alpha = alpha
+        return self
+
+    def predict( self, X ):
+        Xs = self.scale( X )
+        k = self.kernel( Xs, self.X, self.length_scale )
+        mean = k @ self.alpha
+        v = linalg.solve_triangular( self.L, k.T, lower=True )
+        var = self.variance * numpy.maximum( 1.0 - numpy.sum( v**2, axis=0 ), 1e-12 )
+        return self.y_mean + self.y_std * mean, self.y_std * numpy.sqrt( var )
+
+class SurrogateOptimizer:
+    """Minimizes fun(x) -> ( objective, constraints ) subject to constraints >= 0 using one Gaussian process per output.
+    Each new solve is placed at the maximizer of constrained expected improvement; until a feasible design is known,
+    it is placed where the surrogate is most likely to satisfy the constraints instead."""
+    def __init__( self, fun, bounds, max_solves=10, num_initial=3, num_candidates=2001, ei_tol=1e-4, x_tol=1e-3, seed=0 ):
+        self.fun = fun
+        self.lower = numpy.array( [ bound[0] for bound in bounds ], dtype=float )
+        self.upper = numpy.array( [ bound[1] for bound in bounds ], dtype=float )
+        self.max_solves = max_solves
+        self.num_initial = num_initial
+        self.num_candidates = num_candidates
+        self.ei_tol = ei_tol
+        self.x_tol = x_tol
+        self.rng = numpy.random.default_rng( seed )
+        self.X = []
+        self.F = []
+        self.G = []
+        self.num_solves = 0
+
+    def add_sample( self, x, objective, constraints ):
+        self.X.append( numpy.asarray( x, dtype=float ) )
+        self.F.append( float( objective ) )
+        self.G.append( numpy.atleast_1d( numpy.asarray( constraints, dtype=float ) ) )
+
+    def solve( self, x ):
+        objective, constraints = self.fun( x )
+        self.num_solves += 1
+        self.add_sample( x, objective, constraints )
+
+    def candidates( self ):
+        dim = len( self.lower )
+        if dim == 1:
+            unit = numpy.linspace( 0.0, 1.0, self.num_candidates )[:, None]
+        else:
+            unit = self.rng.random( ( self.num_candidates, dim ) )
+        return self.lower + unit * ( self.upper - self.lower )
+
+    def initial_design( self ):
+        # Stratified over each coordinate; previously completed runs count towards the initial design
+        num_new = max( self.num_initial - len( self.X ), 0 )
+        dim = len( self.lower )
+        unit = numpy.empty( ( num_new, dim ) )
+        for d in range( 0, dim ):
+            unit[:, d] = ( self.rng.permutation( num_new ) + 0.5 ) / max( num_new, 1 )
+        return self.lower + unit * ( self.upper - self.lower )
+
+    def best_feasible( self ):
+        feasible = [ i for i in range( 0, len( self.F ) ) if numpy.all( self.G[i] >= 0 ) ]
+        if len( feasible ) == 0:
+            return None
+        return min( feasible, key=lambda i: self.F[i] )
+
+    def acquisition( self, Xc ):
+        X = numpy.array( self.X )
+        f_mean, f_std = GaussianProcess( self.lower, self.upper ).fit( X, self.F ).predict( Xc )
+        G = numpy.array( self.G )
+        prob_feasible = numpy.ones( len( Xc ) )
+        for j in range( 0, G.shape[1] ):
+            g_mean, g_std = GaussianProcess( self.lower, self.upper ).fit( X, G[:, j] ).predict( Xc )
+            prob_feasible *= stats.norm.cdf( g_mean / g_std )
+        best = self.best_feasible()
+        if best is None:
+            return prob_feasible, None
+        z = ( self.F[best] - f_mean ) / f_std
+        expected_improvement = f_std * ( z * stats.norm.cdf( z ) + stats.norm.pdf( z ) )
+        return expected_improvement * prob_feasible, self.F[best]
+
+    def minimize( self ):
+        for x in self.initial_design():
+            if self.num_solves >= self.max_solves:
+                break
+            self.solve( x )
+        message = "Maximum number of solves reached"
+        while self.num_solves < self.max_solves:
+            Xc = self.candidates()
+            acquisition, f_best = self.acquisition( Xc )
+            i = int( numpy.argmax( acquisition ) )
+            if f_best is not None and acquisition[i] <= self.ei_tol * max( abs( f_best ), 1.0 ):
+                message = "Expected improvement below tolerance"
+                break
+            spacing = numpy.min( numpy.max( numpy.abs( ( numpy.array( self.X ) - Xc[i] ) / ( self.upper - self.lower ) ), axis=1 ) )
+            if spacing < self.x_tol:
+                message = "Next infill point coincides with an existing sample"
+                break
+            self.solve( Xc[i] )
+        best = self.best_feasible()
+        if best is None:
+            best = int( numpy.argmax( [ numpy.min( g ) for g in self.G ] ) )
+        return scipy.optimize.OptimizeResult( x=self.X[best], fun=self.F[best], constr=self.G[best],
+                                              success=bool( numpy.all( self.G[best] >= 0 ) ), message=message,
+                                              nfev=self.num_solves, nsamples=len( self.X ) )
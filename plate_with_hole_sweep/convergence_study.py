@@ -0,0 +1,129 @@
+#!python3
+
+import os
+import time
+import json
+import pathlib
+import argparse
+import numpy
+import plate_with_hole_sweep
+import run_coreform_flex
+
+parser = argparse.ArgumentParser( prog='PlateWithHoleConvergenceStudy' )
+
+def cli_arguments( parser ):
+    parser.add_argument( "-nt", dest="nt", type=int, default=1 )
+    parser.add_argument( "-ni", dest="ni", type=int, default=1 )
+    parser.add_argument( "--radius", dest="radius", type=float, default=10.0 )
+    parser.add_argument( "--strategy", dest="strategy", type=str, choices=["bodyfit", "immersed"], default="immersed" )
+    parser.add_argument( "--degrees", dest="degrees", type=int, nargs="+", default=[ 2, 3, 4 ] )
+    parser.add_argument( "--coarsest-mesh-size", dest="coarsest_mesh_size", type=float, default=8.0 )
+    parser.add_argument( "--refinement-ratio", dest="refinement_ratio", type=float, default=2.0 )
+    parser.add_argument( "--num-levels", dest="num_levels", type=int, default=3 )
+    parser.add_argument( "--target-error", dest="target_error", type=float, default=0.01, help="Relative discretization error allowed on every probe" )
+    parser.add_argument( "--no-flex-journal", dest="flex_journal", action="store_false", help="Send the Flex model setup one command at a time, timing each, instead of as one journal playback" )
+    parser.add_argument( "--linear-solver", dest="linear_solver", type=str, choices=["auto", "direct", "iterative"], default="auto", help="Linear solver; auto picks direct LU when its estimated memory fits" )
+    return parser.parse_args()
+
+top_wd = os.getcwd()
+results_file = "convergence_study.json"
+probe_names = ( "max_displacement", "max_stress" )
+# Safety factor applied to Richardson error estimates (Roache's grid convergence index for three or more levels)
+safety_factor = 1.25
+
+def main( args ):
+    args = vars( args )
+    args["top_wd"] = pathlib.Path( top_wd ).as_posix()
+    args["warm_start"] = False
+    mesh_sizes = [ args["coarsest_mesh_size"] / args["refinement_ratio"]**level for level in range( 0, args["num_levels"] ) ]
+    case_args = []
+    for degree in args["degrees"]:
+        for level in range( 0, len( mesh_sizes ) ):
+            case_args.append( make_case_args( args, degree, level, mesh_sizes[level] ) )
+    # Cases run one at a time: wall time is the cost the recommendation compares, and concurrent cases would skew it
+    warm_up( args )
+    case_results = [ run_timed_case( c_args ) for c_args in case_args ]
+    cases = []
+    for c_args, case_result in zip( case_args, case_results ):
+        cases.append( { "degree": c_args["degree"], "level": c_args["level"], "mesh_size": c_args["mesh_size"], **case_result } )
+    study = analyze( cases, args["refinement_ratio"], args["target_error"] )
+    print_study( study )
+    with open( os.path.join( top_wd, results_file ), "w" ) as f:
+        json.dump( study, f, indent=2 )
+    run_coreform_flex.ctx.print_timings()
+    run_coreform_flex.ctx.exit_flex()
+
+def make_case_args( args, degree, level, mesh_size ):
+    case_wd = pathlib.Path( os.path.join( args["top_wd"], f"convergence_p{degree}_h{level}" ) ).as_posix()
+    if not os.path.exists( case_wd ):
+        os.makedirs( case_wd )
+    c_args = dict( args )
+    c_args["top_wd"] = case_wd
+    c_args["degree"] = int( degree )
+    c_args["level"] = level
+    c_args["mesh_size"] = float( mesh_size )
+    return c_args
+
+def warm_up( args ):
+    # Cubit and Flex start, and the Flex model template is built and saved, once per process; doing that here keeps it
+    # out of the first case's wall time
+    run_coreform_flex.ctx.cubit()
+    run_coreform_flex.get_model_template( args )
+
+def run_timed_case( args ):
+    start_time = time.perf_counter()
+    max_displacement, max_stress = plate_with_hole_sweep.run_case( args )
+    return { "max_displacement": max_displacement, "max_stress": max_stress, "wall_time": time.perf_counter() - start_time }
+
+def richardson_extrapolation( values, refinement_ratio, nominal_order ):
+    """Extrapolates values computed on a ladder refined by refinement_ratio (coarsest first) to zero mesh size.
+    With three or more levels the order is observed from the finest three, falling back to nominal_order
+    when they do not converge monotonically. Returns ( extrapolated value, order used )."""
+    values = numpy.asarray( values, dtype=float )
+    order = nominal_order
+    if len( values ) >= 3:
+        coarse_diff = values[-2] - values[-3]
+        fine_diff = values[-1] - values[-2]
+        if coarse_diff != 0.0 and fine_diff != 0.0 and fine_diff / coarse_diff > 0.0 and abs( fine_diff ) < abs( coarse_diff ):
+            order = numpy.log( coarse_diff / fine_diff ) / numpy.log( refinement_ratio )
+    if len( values ) < 2:
+        return float( values[-1] ), float( order )
+    extrapolated = values[-1] + ( values[-1] - values[-2] ) / ( refinement_ratio**order - 1.0 )
+    return float( extrapolated ), float( order )
+
+def analyze( cases, refinement_ratio, target_error ):
+    # Each degree is extrapolated along its own ladder; every case's error is measured against its degree's extrapolation
+    study = { "refinement_ratio": refinement_ratio, "target_error": target_error, "degrees": {}, "cases": cases }
+    for degree in sorted( set( case["degree"] for case in cases ) ):
+        ladder = sorted( [ case for case in cases if case["degree"] == degree ], key=lambda case: case["level"] )
+        study["degrees"][degree] = {}
+        for name in probe_names:
+            # Nominal orders for smooth solutions: degree + 1 for displacements, degree for stresses
+            nominal_order = degree + 1 if name == "max_displacement" else degree
+            extrapolated, order = richardson_extrapolation( [ case[name] for case in ladder ], refinement_ratio, nominal_order )
+            study["degrees"][degree][name] = { "extrapolated": extrapolated, "order": order }
+            for case in ladder:
+                scale = abs( extrapolated ) if extrapolated != 0.0 else 1.0
+                case[f"{name}_error"] = safety_factor * abs( case[name] - extrapolated ) / scale
+    feasible = [ case for case in cases if all( case[f"{name}_error"] <= target_error for name in probe_names ) ]
+    if len( feasible ) > 0:
+        best = min( feasible, key=lambda case: case["wall_time"] )
+        study["recommendation"] = { "degree": best["degree"], "mesh_size": best["mesh_size"], "wall_time": best["wall_time"] }
+    else:
+        study["recommendation"] = None
+    return study
+
+def print_study( study ):
+    print( f"{'degree':>6} {'mesh_size':>10} {'wall_time':>10} " + " ".join( f"{name:>18} {'error':>9}" for name in probe_names ) )
+    for case in sorted( study["cases"], key=lambda case: ( case["degree"], case["level"] ) ):
+        print( f"{case['degree']:>6} {case['mesh_size']:>10.4g} {case['wall_time']:>10.2f} " + " ".join( f"{case[name]:>18.8g} {case[name + '_error']:>9.2e}" for name in probe_names ) )
+    for degree, extrapolation in study["degrees"].items():
+        print( f"degree {degree}: " + ", ".join( f"{name} -> {extrapolation[name]['extrapolated']:.8g} (order {extrapolation[name]['order']:.2f})" for name in probe_names ) )
+    recommendation = study["recommendation"]
+    if recommendation is None:
+        print( f"No discretization in the study meets the target error of {study['target_error']}; extend the ladder" )
+    else:
+        print( f"Cheapest discretization within {study['target_error']}: --degree {recommendation['degree']} --mesh-size {recommendation['mesh_size']:.4g} ({recommendation['wall_time']:.2f} s)" )
+
+if __name__ == '__main__':
+    main( cli_arguments( parser ) )
@@ -0,0 +1,125 @@
+import time
+import queue
+import threading
+import multiprocessing
+import concurrent.futures
+
+class Stage:
+    def __init__( self, name, function, num_workers=1 ):
+        self.name = name
+        self.function = function
+        self.num_workers = max( int( num_workers ), 1 )
+        self.busy_time = 0.0
+        self.starved_time = 0.0
+        self.blocked_time = 0.0
+        self.num_items = 0
+        self.lock = threading.Lock()
+
+    def reset_stats( self ):
+        self.busy_time = 0.0
+        self.starved_time = 0.0
+        self.blocked_time = 0.0
+        self.num_items = 0
+
+class StageFailure:
+    def __init__( self, stage_name, error ):
+        self.stage_name = stage_name
+        self.error = error
+
+_stop = object()
+
+class Pipeline:
+    """Runs items through a chain of stages. Each stage is a pool of worker processes and stages are joined
+    by bounded queues, so stage k of item i+1 overlaps stage k+1 of item i and a slow stage throttles its producers."""
+    def __init__( self, stages, queue_size=1 ):
+        self.stages = stages
+        self.queue_size = max( int( queue_size ), 1 )
+        self.wall_time = 0.0
+
+    def run( self, items ):
+        for stage in self.stages:
+            stage.reset_stats()
+        start_time = time.perf_counter()
+        queues = [ queue.Queue( maxsize=self.queue_size ) for stage in self.stages ]
+        queues.append( queue.Queue() )
+        mp_context = multiprocessing.get_context( "spawn" )
+        pools = [ concurrent.futures.ProcessPoolExecutor( max_workers=stage.num_workers, mp_context=mp_context ) for stage in self.stages ]
+        stage_threads = []
+        for k in range( 0, len( self.stages ) ):
+            threads = []
+            for w in range( 0, self.stages[k].num_workers ):
+                thread = threading.Thread( target=self.stage_worker, args=( self.stages[k], pools[k], queues[k], queues[k+1] ), daemon=True )
+                thread.start()
+                threads.append( thread )
+            stage_threads.append( threads )
+        feeder = threading.Thread( target=self.feed, args=( items, queues[0], self.stages[0].num_workers ), daemon=True )
+        feeder.start()
+        # Shut stages down front to back: once every worker of stage k is done, stage k+1 gets its stop tokens
+        feeder.join()
+        for k in range( 0, len( self.stages ) ):
+            for thread in stage_threads[k]:
+                thread.join()
+            if k + 1 < len( self.stages ):
+                for w in range( 0, self.stages[k+1].num_workers ):
+                    queues[k+1].put( _stop )
+        for pool in pools:
+            pool.shutdown()
+        results = [ None ] * len( items )
+        while not queues[-1].empty():
+            index, result = queues[-1].get()
+            results[index] = result
+        self.wall_time = time.perf_counter() - start_time
+        for result in results:
+            if isinstance( result, StageFailure ):
+                raise RuntimeError( f"Pipeline stage '{result.stage_name}' failed" ) from result.error
+        return results
+
+    def feed( self, items, in_queue, num_workers ):
+        for index in range( 0, len( items ) ):
+            in_queue.put( ( index, items[index] ) )
+        for w in range( 0, num_workers ):
+            in_queue.put( _stop )
+
+    def stage_worker( self, stage, pool, in_queue, out_queue ):
+        while True:
+            wait_start = time.perf_counter()
+            item = in_queue.get()
+            starved_time = time.perf_counter() - wait_start
+            if item is _stop:
+                break
+            index, value = item
+            busy_start = time.perf_counter()
+            if isinstance( value, StageFailure ):
+                result = value
+            else:
+                try:
+                    result = pool.submit( stage.function, value ).result()
+                except Exception as error:
+                    result = StageFailure( stage.name, error )
+            busy_time = time.perf_counter() - busy_start
+            put_start = time.perf_counter()
+            out_queue.put( ( index, result ) )
+            blocked_time = time.perf_counter() - put_start
+            with stage.lock:
+                stage.num_items += 1
+                stage.busy_time += busy_time
+                stage.starved_time += starved_time
+                stage.blocked_time += blocked_time
+
+    def stage_stats( self ):
+        stats = {}
+        for stage in self.stages:
+            capacity = stage.num_workers * self.wall_time
+            stats[stage.name] = { "num_workers": stage.num_workers,
+                                  "num_items": stage.num_items,
+                                  "utilization": stage.busy_time / capacity if capacity > 0 else 0.0,
+                                  "mean_service_time": stage.busy_time / stage.num_items if stage.num_items > 0 else 0.0,
+                                  "starved_time": stage.starved_time,
+                                  "blocked_time": stage.blocked_time }
+        return stats
+
+    def print_stats( self ):
+        print( f"Pipeline wall time: {self.wall_time:.3f} s" )
+        for name, stats in self.stage_stats().items():
+            print( f"  {name}: {stats['num_items']} item(s) on {stats['num_workers']} worker(s), utilization {100 * stats['utilization']:.1f}%, "
+                   f"mean {stats['mean_service_time']:.3f} s per item, starved {stats['starved_time']:.3f} s, blocked {stats['blocked_time']:.3f} s" )
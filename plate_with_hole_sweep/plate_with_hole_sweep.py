@@ -1,12 +1,19 @@
 #!python3
 
 import os
+import time
 import pathlib
 import argparse
 import numpy
 import json
+import asyncio
+import multiprocessing
+import concurrent.futures
 import run_coreform_cubit
 import run_coreform_flex
+import probe_results
+import pipeline
+import result_store
 from coreform_utils import mk_script_relative
 
 parser = argparse.ArgumentParser( prog='PlateWithHoleSweep' )
@@ -14,46 +21,158 @@ parser = argparse.ArgumentParser( prog='PlateWithHoleSweep' )
 def cli_arguments( parser ):
     parser.add_argument( "-nt", dest="nt", type=int, default=1 )
     parser.add_argument( "-ni", dest="ni", type=int, default=1 )
+    parser.add_argument( "-nj", dest="nj", type=int, default=1, help="Number of sweep cases to run concurrently" )
+    parser.add_argument( "--overlap-cad", dest="overlap_cad", action="store_true", help="Build the next geometry while the current case solves" )
+    parser.add_argument( "--pipeline", dest="pipeline", action="store_true", help="Run geometry, trim and IGA as separate pipelined stages" )
+    parser.add_argument( "--cad-workers", dest="cad_workers", type=int, default=1 )
+    parser.add_argument( "--trim-workers", dest="trim_workers", type=int, default=1 )
+    parser.add_argument( "--iga-workers", dest="iga_workers", type=int, default=1 )
+    parser.add_argument( "--queue-size", dest="queue_size", type=int, default=1, help="Designs allowed to wait between pipeline stages" )
     parser.add_argument( "--strategy", dest="strategy", type=str, choices=["bodyfit", "immersed"], default="immersed" )
     parser.add_argument( "--mesh-size", dest="mesh_size", type=float, default=4 )
     parser.add_argument( "--degree", dest="degree", type=int, default=4 )
+    parser.add_argument( "--no-flex-journal", dest="flex_journal", action="store_false", help="Send the Flex model setup one command at a time, timing each, instead of as one journal playback" )
+    parser.add_argument( "--linear-solver", dest="linear_solver", type=str, choices=["auto", "direct", "iterative"], default="auto", help="Linear solver; auto picks direct LU when its estimated memory fits" )
+    parser.add_argument( "--warm-start", dest="warm_start", action="store_true", help="Start each solve's iterative linear solver from the previous design's displacements" )
+    parser.add_argument( "--result-store", dest="result_store", type=str, default="result_store", help="Directory of the evaluation history shared across runs" )
     return parser.parse_args()
 
 script_relative = mk_script_relative( __file__ )
 top_wd = os.getcwd()
 log_file = "sweep_monitor.log"
 yield_stress = 36260 # PSI
+displacement_path = "pull/history/disp_probe/displacement/x"
+stress_path = "pull/history/stress_probe/stress/max_principal"
+store_settings = ( "strategy", "degree", "mesh_size", "nt", "ni", "linear_solver", "warm_start" )
 
 def main( args ):
+    if args.warm_start and ( args.pipeline or args.nj > 1 ):
+        # Warm-start state lives in the process that solves, so pooled or pipelined solves would never see it
+        parser.error( "--warm-start needs every solve in the main process; drop -nj and --pipeline" )
     args = vars( args )
     args["top_wd"] = pathlib.Path( top_wd ).as_posix()
     N = 4
     radius_list = numpy.linspace( 0.1, 24.9, N )
     displacement_list = numpy.zeros( N )
     max_stress_list = numpy.zeros( N )
+    # The pipeline sizes its own stages, so -nj only applies to the other modes
+    num_workers = 1 if args["pipeline"] else get_num_workers( args, len( radius_list ) )
+    # Solves that may run at once, which share the memory budget of the direct solver
+    args["concurrent_solves"] = args["iga_workers"] if args["pipeline"] else num_workers
+    case_args = []
     for i in range( 0, len( radius_list ) ):
-        args["radius"] = radius_list[i]
-        run_coreform_cubit.main( args )
-        run_coreform_flex.main( args )
-        displacement_list[i] = get_max_displacement()
-        max_stress_list[i] = get_max_stress()
+        case_args.append( make_case_args( args, i, radius_list[i] ) )
+    # Overlapped modes share cores between cases, so they have no per-case wall time
+    wall_times = [ None ] * len( case_args )
+    if args["pipeline"]:
+        case_results = run_cases_pipelined( case_args, args )
+    elif num_workers == 1 and args["overlap_cad"]:
+        case_results = asyncio.run( run_cases_async( case_args ) )
+    elif num_workers == 1:
+        case_results, wall_times, snapshots = zip( *[ time_case( c_args ) for c_args in case_args ] )
+    else:
+        # Spawn rather than fork so every worker initializes its own Cubit and Flex instances
+        mp_context = multiprocessing.get_context( "spawn" )
+        with concurrent.futures.ProcessPoolExecutor( max_workers=num_workers, mp_context=mp_context ) as pool:
+            case_results, wall_times, snapshots = zip( *pool.map( time_case, case_args ) )
+        for snapshot in snapshots:
+            run_coreform_flex.ctx.add_worker_timings( snapshot )
+    store = result_store.ResultStore( os.path.join( args["top_wd"], args["result_store"] ) )
+    for i in range( 0, len( case_results ) ):
+        displacement_list[i], max_stress_list[i] = case_results[i]
+        record_case( store, case_args[i], case_results[i], wall_times[i] )
+    store.close()
     print( radius_list )
     print( displacement_list )
     print( max_stress_list )
+    if args["warm_start"]:
+        run_coreform_flex.ctx.warm_start().print_summary()
+    run_coreform_flex.ctx.print_timings()
+    run_coreform_flex.ctx.exit_flex()
 
-def get_max_displacement():
-    probe_filename = os.path.join( top_wd, "cf_iga_data_output.json" )
-    with open( probe_filename ) as probe_file:
-        probe_data = json.load( probe_file )['pull']['history']
-        max_displacement = probe_data['disp_probe']['displacement']['x'][-1][-1]
-    return max_displacement
-
-def get_max_stress():
-    probe_filename = os.path.join( top_wd, "cf_iga_data_output.json" )
-    with open( probe_filename ) as probe_file:
-        probe_data = json.load( probe_file )['pull']['history']
-        max_stress = probe_data['stress_probe']['stress']['max_principal'][-1][-1]
-    return max_stress
+def make_case_args( args, case_id, radius ):
+    case_wd = pathlib.Path( os.path.join( args["top_wd"], f"sweep_case_{case_id}" ) ).as_posix()
+    if not os.path.exists( case_wd ):
+        os.makedirs( case_wd )
+    c_args = dict( args )
+    c_args["top_wd"] = case_wd
+    c_args["radius"] = float( radius )
+    return c_args
+
+def get_num_workers( args, num_cases ):
+    # Trim and IGA run one after the other within a case, so a case never holds more than max( nt, ni ) cores
+    cores_per_case = max( args["nt"], args["ni"] )
+    max_workers = max( 1, ( os.cpu_count() or 1 ) // cores_per_case )
+    num_workers = max( 1, min( args["nj"], max_workers, num_cases ) )
+    if max_workers < args["nj"]:
+        print( f"Limiting sweep concurrency to {max_workers} case(s) ({cores_per_case} core(s) per case)" )
+    return num_workers
+
+def run_case( args ):
+    run_coreform_cubit.main( args )
+    run_coreform_flex.main( args )
+    return get_max_displacement( args["top_wd"] ), get_max_stress( args["top_wd"] )
+
+def time_case( args ):
+    start_time = time.perf_counter()
+    case_result = run_case( args )
+    return case_result, time.perf_counter() - start_time, run_coreform_flex.ctx.timings_snapshot()
+
+def record_case( store, args, case_result, wall_time ):
+    settings = { name: args[name] for name in store_settings }
+    values = { "max_displacement": case_result[0], "max_stress": case_result[1] }
+    store.record( "plate_with_hole_sweep", { "radius": args["radius"] }, settings, values, get_probe_data( args["top_wd"] ), wall_time )
+
+def run_cases_pipelined( case_args, args ):
+    num_cores = args["cad_workers"] + args["trim_workers"] * args["nt"] + args["iga_workers"] * args["ni"]
+    if num_cores > ( os.cpu_count() or 1 ):
+        print( f"WARNING: pipeline stages request {num_cores} cores but only {os.cpu_count()} are available" )
+    stages = [ pipeline.Stage( "geometry", run_coreform_cubit.run_geometry, args["cad_workers"] ),
+               pipeline.Stage( "trim", run_coreform_flex.run_trim, args["trim_workers"] ),
+               pipeline.Stage( "iga", run_coreform_flex.run_iga, args["iga_workers"] ) ]
+    sim_pipeline = pipeline.Pipeline( stages, args["queue_size"] )
+    finished_args = sim_pipeline.run( case_args )
+    sim_pipeline.print_stats()
+    for c_args in finished_args:
+        for snapshot in c_args["session_timings"]:
+            run_coreform_flex.ctx.add_worker_timings( snapshot )
+    return [ ( get_max_displacement( c_args["top_wd"] ), get_max_stress( c_args["top_wd"] ) ) for c_args in finished_args ]
+
+async def run_cases_async( case_args ):
+    # Cubit runs in its own process so geometry for design i+1 is built while design i is in Flex
+    mp_context = multiprocessing.get_context( "spawn" )
+    with concurrent.futures.ProcessPoolExecutor( max_workers=1, mp_context=mp_context ) as cad_pool:
+        tasks = []
+        previous_task = None
+        for c_args in case_args:
+            previous_task = asyncio.create_task( run_case_async( c_args, cad_pool, previous_task ) )
+            tasks.append( previous_task )
+        case_results = await asyncio.gather( *tasks )
+    await run_coreform_flex.ctx.jobs().call( run_coreform_flex.ctx.exit_flex )
+    return case_results
+
+async def run_case_async( args, cad_pool, previous_task ):
+    loop = asyncio.get_running_loop()
+    geometry_args = await loop.run_in_executor( cad_pool, run_coreform_cubit.run_geometry, args )
+    run_coreform_flex.ctx.add_worker_timings( geometry_args["session_timings"][-1] )
+    if previous_task is not None:
+        # Flex holds a single model, so solves still run one after another
+        await previous_task
+    await run_coreform_flex.main_async( args )
+    return get_max_displacement( args["top_wd"] ), get_max_stress( args["top_wd"] )
+
+def get_probe_data( workdir ):
+    # Both quantities are requested together so the output file is parsed once per case
+    probe_filename = os.path.join( workdir, "cf_iga_data_output.json" )
+    return probe_results.read_probes( probe_filename, [ displacement_path, stress_path ] )
+
+def get_max_displacement( workdir ):
+    max_displacement = get_probe_data( workdir )[displacement_path][-1][-1]
+    return float( max_displacement )
+
+def get_max_stress( workdir ):
+    max_stress = get_probe_data( workdir )[stress_path][-1][-1]
+    return float( max_stress )
 
 if __name__ == '__main__':
     main( cli_arguments( parser ) )
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import numpy
+
+class ResultStore:
+    """Evaluation history shared by every run in a directory: one SQLite row per evaluation, with design parameters and
+    scalar results indexed by name and value, and probe histories stored as numpy arrays in one NPZ file per flush.
+    Records are buffered in memory and written in a single transaction every flush_every evaluations."""
+    def __init__( self, directory, flush_every=16 ):
+        self.directory = directory
+        self.flush_every = max( int( flush_every ), 1 )
+        self.buffer = []
+        os.makedirs( os.path.join( directory, "histories" ), exist_ok=True )
+        # Concurrent runs share the database; SQLite serializes their flushes
+        self.db = sqlite3.connect( os.path.join( directory, "results.sqlite" ), timeout=60.0 )
+        self.db.executescript( """
+            CREATE TABLE IF NOT EXISTS evaluations ( id INTEGER PRIMARY KEY, study TEXT, status TEXT, wall_time REAL, created REAL,
+                                                     settings TEXT, history_file TEXT, history_index INTEGER );
+            CREATE TABLE IF NOT EXISTS quantities ( evaluation_id INTEGER, kind TEXT, name TEXT, value REAL );
+            CREATE INDEX IF NOT EXISTS evaluations_by_study ON evaluations ( study, status );
+            CREATE INDEX IF NOT EXISTS quantities_by_value ON quantities ( kind, name, value );
+            CREATE INDEX IF NOT EXISTS quantities_by_evaluation ON quantities ( evaluation_id );
+        """ )
+        atexit.register( self.close )
+
+    def record( self, study, design, settings, values, histories=None, wall_time=None, status="ok" ):
+        """Queues one evaluation. design and values map names to floats, settings is any JSON-serializable dict
+        and histories maps probe paths to arrays."""
+        self.buffer.append( { "study": study,
+                              "design": { name: float( value ) for name, value in design.items() },
+                              "settings": settings,
+                              "values": { name: float( value ) for name, value in values.items() },
+                              "histories": { path: numpy.asarray( value ) for path, value in ( histories or {} ).items() },
+                              "wall_time": None if wall_time is None else float( wall_time ),
+                              "status": status,
+                              "created": time.time() } )
+        if len( self.buffer ) >= self.flush_every:
+            self.flush()
+
+    def flush( self ):
+        if len( self.buffer ) == 0:
+            return
+        records, self.buffer = self.buffer, []
+        history_file = None
+        if any( len( record["histories"] ) > 0 for record in records ):
+            history_file = f"{uuid.uuid4().hex}.npz"
+            arrays = { f"{i}/{path}": value for i, record in enumerate( records ) for path, value in record["histories"].items() }
+            numpy.savez( os.path.join( self.directory, "histories", history_file ), **arrays )
+        with self.db:
+            for i, record in enumerate( records ):
+                cursor = self.db.execute( "INSERT INTO evaluations ( study, status, wall_time, created, settings, history_file, history_index ) VALUES ( ?, ?, ?, ?, ?, ?, ? )",
+                                          ( record["study"], record["status"], record["wall_time"], record["created"], json.dumps( record["settings"], sort_keys=True ),
+                                            history_file if len( record["histories"] ) > 0 else None, i ) )
+                quantities = [ ( cursor.lastrowid, "design", name, value ) for name, value in record["design"].items() ]
+                quantities += [ ( cursor.lastrowid, "value", name, value ) for name, value in record["values"].items() ]
+                self.db.executemany( "INSERT INTO quantities ( evaluation_id, kind, name, value ) VALUES ( ?, ?, ?, ? )", quantities )
+
+    def close( self ):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def find( self, study=None, status="ok", **design_ranges ):
+        """Returns the ids of evaluations whose design parameters lie in the given ( lower, upper ) ranges
+        (a single number matches exactly), using the value index."""
+        self.flush()
+        query = "SELECT id FROM evaluations WHERE 1"
+        arguments = []
+        if study is not None:
+            query += " AND study = ?"
+            arguments.append( study )
+        if status is not None:
+            query += " AND status = ?"
+            arguments.append( status )
+        for name, bounds in design_ranges.items():
+            lower, upper = bounds if isinstance( bounds, ( tuple, list ) ) else ( bounds, bounds )
+            query += " AND id IN ( SELECT evaluation_id FROM quantities WHERE kind = 'design' AND name = ? AND value BETWEEN ? AND ? )"
+            arguments += [ name, lower, upper ]
+        return [ row[0] for row in self.db.execute( query + " ORDER BY id", arguments ) ]
+
+    def columns( self, ids, names, kind="value" ):
+        """Returns { name: array } over the given evaluations, nan where an evaluation has no such quantity."""
+        self.flush()
+        ids = list( ids )
+        position = { evaluation_id: i for i, evaluation_id in enumerate( ids ) }
+        columns = { name: numpy.full( len( ids ), numpy.nan ) for name in names }
+        # Chunked to stay below SQLite's limit on bound parameters
+        for start in range( 0, len( ids ), 500 ):
+            chunk = ids[start:start + 500]
+            query = f"SELECT evaluation_id, name, value FROM quantities WHERE kind = ? AND evaluation_id IN ( {', '.join( '?' * len( chunk ) )} )"
+            for evaluation_id, name, value in self.db.execute( query, [ kind ] + chunk ):
+                if name in columns:
+                    columns[name][position[evaluation_id]] = value
+        return columns
+
+    def evaluation( self, evaluation_id ):
+        self.flush()
+        row = self.db.execute( "SELECT study, status, wall_time, created, settings FROM evaluations WHERE id = ?", ( evaluation_id, ) ).fetchone()
+        if row is None:
+            raise KeyError( f"No evaluation {evaluation_id} in {self.directory}" )
+        quantities = self.db.execute( "SELECT kind, name, value FROM quantities WHERE evaluation_id = ?", ( evaluation_id, ) ).fetchall()
+        return { "id": evaluation_id, "study": row[0], "status": row[1], "wall_time": row[2], "created": row[3], "settings": json.loads( row[4] ),
+                 "design": { name: value for kind, name, value in quantities if kind == "design" },
+                 "values": { name: value for kind, name, value in quantities if kind == "value" } }
+
+    def history( self, evaluation_id, path ):
+        self.flush()
+        row = self.db.execute( "SELECT history_file, history_index FROM evaluations WHERE id = ?", ( evaluation_id, ) ).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError( f"No probe histories stored for evaluation {evaluation_id}" )
+        with numpy.load( os.path.join( self.directory, "histories", row[0] ) ) as histories:
+            return histories[f"{row[1]}/{path}"]
@@ -2,17 +2,24 @@ import os
 import sys
 import pathlib
 import coreform_utils
-cubit = coreform_utils.import_cubit()
+ctx = coreform_utils.get_session()
 
 def main( args ):
-    cubit.cmd( "reset" )
+    ctx.reset_cubit()
     coupon_vol_id = make_coupon_geometry( args["radius"] )
     assign_sets( coupon_vol_id )
     if args["strategy"] == "bodyfit":
         generate_bodyfit_mesh( args )
     export_model( args )
 
+def run_geometry( args ):
+    main( args )
+    # Stage results carry each worker's session timings back to the parent
+    args.setdefault( "session_timings", [] ).append( ctx.timings_snapshot() )
+    return args
+
 def make_coupon_geometry( radius ):
+    cubit = ctx.cubit()
     cubit.cmd( "bri x 100 y 50 z 1" )
     bri_vol_id = cubit.get_last_id( "volume" )
     cubit.cmd( f"create Cylinder height 1 radius {radius}" )
@@ -24,6 +31,7 @@ def make_coupon_geometry( radius ):
     return bri_vol_id
 
 def assign_sets( coupon_vol_id ):
+    cubit = ctx.cubit()
     cubit.cmd( f"block 1 volume {coupon_vol_id}" )
     cubit.cmd( f"sideset 1 surface in volume {coupon_vol_id} with x_coord<0.01" )
     cubit.cmd( f"sideset 2 surface in volume {coupon_vol_id} with x_coord>49.9" )
@@ -40,6 +48,7 @@ def assign_sets( coupon_vol_id ):
     cubit.cmd( "sideset 6 name 'zmax'" )
 
 def generate_bodyfit_mesh( args ):
+    cubit = ctx.cubit()
     cubit.cmd( "surface in sideset 5 6 scheme polyhedron" )
     cubit.cmd( "surface in sideset 1 2 3 4 interval 1" )
     cubit.cmd( f"surface in sideset 5 6 size {args['mesh_size']}" )
@@ -49,5 +58,6 @@ def generate_bodyfit_mesh( args ):
     cubit.cmd( "mesh volume in block 1" )
 
 def export_model( args ):
+    cubit = ctx.cubit()
     filename = os.path.join( args["top_wd"], "plate_with_hole_geom.cf" )
     cubit.cmd(f'export coreform "{filename}" overwrite')
\ No newline at end of file